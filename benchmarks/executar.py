@@ -0,0 +1,216 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import duckdb
+import pandas as pd
+
+from benchmarks.gerador import gerar, gerar_extrato, gerar_fatura, meses
+from database.main import refresh
+from pages.utils import consultas
+from pages.utils.conexao import Conexao
+from pages.utils.paines import estilizar
+
+
+ANOS = 5
+INICIO = datetime.date(2020, 1, 1)
+
+
+def cronometrar(funcao):
+    inicio = time.perf_counter()
+    resultado = funcao()
+    return resultado, time.perf_counter() - inicio
+
+
+def medir(funcao, preparar=None, colunas_dinheiro=None):
+    df, consulta = cronometrar(funcao)
+    medida = {'linhas': len(df), 'consulta': consulta}
+
+    if preparar:
+        df, medida['pos_processamento'] = cronometrar(lambda: preparar(df))
+
+    if colunas_dinheiro:
+        # _compute() aplica formatação e cores como o st.dataframe faria ao serializar o Styler
+        _, medida['estilo'] = cronometrar(lambda: estilizar(df, colunas_dinheiro)._compute())
+
+    return medida
+
+
+def com_total(df):
+    total = pd.DataFrame({'mes': ['Total'], **{coluna: [df[coluna].sum()] for coluna in df.columns if coluna != 'mes'}})
+    return pd.concat([df, total], ignore_index=True)
+
+
+def busca_sem_indice(con, busca, limite=100):
+    termos = busca.split()
+    filtros = ' and '.join(["lower(descricao) like '%' || ? || '%'"] * len(termos))
+    query = f"""
+        select
+            data
+        ,   tipo
+        ,   valor
+        ,   descricao
+        ,   categoria
+        from
+            extract
+        where
+            {filtros}
+        order by
+            data desc, id desc
+        limit
+            ?
+    """
+
+    return con.execute(query, termos + [limite]).df()
+
+
+def medir_paginas(con):
+    paginas = {}
+
+    mes_extrato = list(consultas.meses_extrato(con)['mes'])
+    mes, meses_graficos = mes_extrato[-1], mes_extrato[-8:]
+    paginas['extrato'] = {
+        'meses': medir(lambda: consultas.meses_extrato(con)),
+        'extrato_do_mes': medir(lambda: consultas.extrato_do_mes(con, mes), None, ['valor', 'valor_acumulado']),
+        'gastos_diarios': medir(lambda: consultas.gastos_diarios_extrato(con, mes)),
+        'saldos_mensais': medir(lambda: consultas.saldos_mensais_extrato(con, meses_graficos), com_total,
+                                ['aplicado', 'resgatado', 'investido', 'ganhos', 'gastos', 'sobras', 'entrada', 'saida', 'saldo_mes']),
+        'distribuicao_gastos': medir(lambda: consultas.distribuicao_gastos_extrato(con, meses_graficos)),
+    }
+
+    mes_fatura = list(consultas.meses_fatura(con)['mes'])
+    mes, meses_graficos = mes_fatura[-1], mes_fatura[-8:]
+    paginas['fatura'] = {
+        'meses': medir(lambda: consultas.meses_fatura(con)),
+        'fatura_do_mes': medir(lambda: consultas.fatura_do_mes(con, mes), None, ['valor']),
+        'gastos_diarios': medir(lambda: consultas.gastos_diarios_fatura(con, mes)),
+        'saldos_mensais': medir(lambda: consultas.saldos_mensais_fatura(con, meses_graficos), com_total,
+                                ['gastos', 'pagamento_fatura', 'saldo_mes']),
+        'distribuicao_gastos': medir(lambda: consultas.distribuicao_gastos_fatura(con, meses_graficos)),
+    }
+
+    # A busca pelo índice de palavras comparada com a varredura do texto de todas as transações, com uma busca
+    # frequente e outra mais seletiva; o LIKE nem remove acentos, o que só o deixa mais rápido
+    paginas['busca'] = {}
+    for nome, busca in (('frequente', 'pix maria'), ('seletiva', 'mercado livre')):
+        paginas['busca'][f'indice_{nome}'] = medir(lambda: consultas.buscar_extrato(con, busca))
+        paginas['busca'][f'like_{nome}'] = medir(lambda: busca_sem_indice(con, busca))
+
+    inicio, fim = consultas.periodo(con)
+    paginas['tendencia'] = {
+        'extrato_diario': medir(lambda: consultas.tendencia_extrato(con, inicio, fim, 500)),
+        'extrato_semanal': medir(lambda: consultas.tendencia_extrato(con, inicio, fim, 500, semanal=True)),
+        'fatura_diaria': medir(lambda: consultas.tendencia_fatura(con, inicio, fim, 500)),
+        'fatura_semanal': medir(lambda: consultas.tendencia_fatura(con, inicio, fim, 500, semanal=True)),
+    }
+
+    return paginas
+
+
+def resumo_ingestao(resultado, duracao):
+    return {'total': duracao, 'fases': resultado.durations, 'linhas': resultado.rows,
+            'arquivos': len(resultado.files_loaded), 'erros': [str(erro) for erro in resultado.errors]}
+
+
+def executar(linhas, anos=ANOS):
+    transacoes_por_mes = max(1, linhas // (anos * 12))
+    pasta_original = os.getcwd()
+
+    with tempfile.TemporaryDirectory(prefix='nubank-benchmark-') as pasta:
+        _, geracao = cronometrar(lambda: gerar(f'{pasta}/data', anos, transacoes_por_mes, inicio=INICIO))
+        os.chdir(pasta)
+        try:
+            resultado, duracao = cronometrar(refresh)
+            ingestao = resumo_ingestao(resultado, duracao)
+
+            # Um novo mês chegando depois de todo o histórico já carregado
+            mes = list(meses(anos + 1, INICIO))[-1]
+            con = duckdb.connect()
+            gerar_extrato(con, f'data/extracts/NU_{mes:%Y-%m}.csv', mes, transacoes_por_mes, 0)
+            gerar_fatura(con, f'data/invoices/Nubank_{mes:%Y-%m}.csv', mes, transacoes_por_mes)
+            con.close()
+            resultado, duracao = cronometrar(refresh)
+            incremental = resumo_ingestao(resultado, duracao)
+
+            con = Conexao()
+            # Mede sempre a execução no DuckDB, sem passar pelo cache das páginas
+            con.geracao = None
+            paginas = medir_paginas(con)
+            con.close()
+
+            tamanho = os.path.getsize('finance.db')
+        finally:
+            os.chdir(pasta_original)
+
+    return {
+        'linhas': linhas,
+        'anos': anos,
+        'transacoes_por_mes': transacoes_por_mes,
+        'geracao_dados': geracao,
+        'ingestao': ingestao,
+        'ingestao_incremental': incremental,
+        'paginas': paginas,
+        'tamanho_base': tamanho,
+    }
+
+
+def commit_atual():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def metricas(valor, prefixo=''):
+    if isinstance(valor, dict):
+        for chave, item in valor.items():
+            yield from metricas(item, f'{prefixo}.{chave}' if prefixo else chave)
+    elif isinstance(valor, float):
+        yield prefixo, valor
+
+
+def comparar(base, atual):
+    anteriores = {resultado['linhas']: dict(metricas(resultado)) for resultado in base['resultados']}
+
+    for resultado in atual['resultados']:
+        anterior = anteriores.get(resultado['linhas'], {})
+        print(f"\n{resultado['linhas']} linhas ({base['commit'] or '?'} -> {atual['commit'] or '?'})")
+        for nome, valor in metricas(resultado):
+            if nome in anterior and anterior[nome] > 0:
+                print(f'  {nome:<60} {anterior[nome]:>10.4f}s {valor:>10.4f}s {valor / anterior[nome]:>7.2f}x')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Mede a ingestão e as consultas dos dashboards com dados sintéticos.')
+    parser.add_argument('--linhas', type=int, nargs='+', default=[10_000, 1_000_000, 10_000_000],
+                        help='Quantidade de transações do extrato (e da fatura) em cada execução')
+    parser.add_argument('--anos', type=int, default=ANOS, help='Anos de histórico gerados')
+    parser.add_argument('--saida', default='benchmark.json', help='Arquivo JSON do relatório')
+    parser.add_argument('--comparar', help='Relatório JSON de outro commit para comparar com este')
+    args = parser.parse_args()
+
+    relatorio = {
+        'commit': commit_atual(),
+        'data': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'duckdb': duckdb.__version__,
+        'pandas': pd.__version__,
+        'resultados': [],
+    }
+
+    for linhas in args.linhas:
+        print(f'Executando com {linhas} linhas...', file=sys.stderr)
+        relatorio['resultados'].append(executar(linhas, args.anos))
+
+    with open(args.saida, 'w') as f:
+        json.dump(relatorio, f, indent=2, ensure_ascii=False, default=str)
+
+    if args.comparar:
+        with open(args.comparar) as f:
+            comparar(json.load(f), relatorio)
@@ -0,0 +1,127 @@
+import argparse
+import datetime
+import os
+
+import duckdb
+
+
+TIPOS_EXTRATO = [
+    # (peso, descrição, sinal, escala do valor)
+    (35, "'Transferência enviada pelo Pix - ' || pessoa || ' - •••.' || documento || '-•• - ' || banco", -1, 5.5),
+    (15, "'Transferência recebida pelo Pix - ' || pessoa || ' - •••.' || documento || '-•• - ' || banco", 1, 6.0),
+    (20, "'Compra no débito - ' || loja", -1, 4.5),
+    (8, "'Aplicação RDB'", -1, 7.0),
+    (5, "'Resgate RDB'", 1, 7.0),
+    (2, "'Compra de CDB'", -1, 7.5),
+    (5, "'Pagamento de fatura'", -1, 7.5),
+    (10, "'Pagamento de boleto efetuado - ' || loja", -1, 5.5),
+]
+
+CATEGORIAS = ['restaurante', 'mercado', 'transporte', 'serviços', 'saúde', 'vestuário', 'lazer', 'casa', 'educação']
+
+PESSOAS = ['MARIA SILVA', 'JOAO SANTOS', 'ANA OLIVEIRA', 'PEDRO SOUZA', 'JULIA LIMA', 'CARLOS PEREIRA']
+BANCOS = ['NU PAGAMENTOS - IP', 'BCO DO BRASIL S.A.', 'ITAÚ UNIBANCO S.A.', 'CAIXA ECONOMICA FEDERAL']
+LOJAS = ['Padaria Pão Quente', 'Supermercado Bom Preço', 'Farmácia Saúde', 'Posto Shell', 'iFood', 'Uber',
+         'Amazon', 'Netflix', 'Spotify', 'Mercado Livre', 'Restaurante Sabor', 'Cinema Center']
+
+
+def lista(valores):
+    return '[' + ', '.join("'" + valor.replace("'", "''") + "'" for valor in valores) + ']'
+
+
+def escolha(valores, coluna):
+    return f'{lista(valores)}[1 + cast({coluna} % {len(valores)} as bigint)]'
+
+
+def meses(anos, inicio):
+    for i in range(anos * 12):
+        ano, mes = divmod(inicio.month - 1 + i, 12)
+        yield datetime.date(inicio.year + ano, mes + 1, 1)
+
+
+def gerar_extrato(con, caminho, mes, transacoes, semente):
+    total = sum(peso for peso, *_ in TIPOS_EXTRATO)
+    casos, acumulado = [], 0
+    for peso, descricao, sinal, escala in TIPOS_EXTRATO:
+        acumulado += peso
+        casos.append(f'when sorteio < {acumulado / total} then struct_pack(d := {descricao}, v := {sinal} * round(exp(random() * {escala}), 2))')
+
+    query = f"""
+        copy (
+            select
+                strftime(dia, '%d/%m/%Y') as "Data"
+            ,   movimento.v as "Valor"
+            ,   substr(h, 1, 8) || '-' || substr(h, 9, 4) || '-' || substr(h, 13, 4) || '-' || substr(h, 17, 4) || '-' || substr(h, 21, 12) as "Identificador"
+            ,   movimento.d as "Descrição"
+            from (
+                select
+                    *
+                ,   case {' '.join(casos)} end as movimento
+                from (
+                    select
+                        md5('{semente}-{mes}-' || i) as h
+                    ,   date '{mes}' + cast(floor(random() * day(last_day(date '{mes}'))) as integer) as dia
+                    ,   random() as sorteio
+                    ,   {escolha(PESSOAS, 'hash(i)')} as pessoa
+                    ,   {escolha(BANCOS, 'hash(i + 1)')} as banco
+                    ,   {escolha(LOJAS, 'hash(i + 2)')} as loja
+                    ,   lpad(cast(hash(i) % 1000 as varchar), 3, '0') || '.' || lpad(cast(hash(i + 3) % 1000 as varchar), 3, '0') as documento
+                    from
+                        range({transacoes}) t(i)
+                )
+            )
+            order by
+                dia
+        ) to '{caminho}' (header, delimiter ',');
+    """
+
+    con.sql(query)
+
+
+def gerar_fatura(con, caminho, mes, transacoes):
+    query = f"""
+        copy (
+            select
+                strftime(dia, '%Y-%m-%d') as date
+            ,   if(pagamento, '', {escolha(CATEGORIAS, 'hash(i)')}) as category
+            ,   if(pagamento, 'Pagamento recebido', {escolha(LOJAS, 'hash(i + 1)')}) as title
+            ,   if(pagamento, -round(exp(random() * 8), 2), round(exp(random() * 5), 2)) as amount
+            from (
+                select
+                    i
+                ,   date '{mes}' + cast(floor(random() * day(last_day(date '{mes}'))) as integer) as dia
+                ,   i = 0 as pagamento
+                from
+                    range({transacoes}) t(i)
+            )
+            order by
+                dia
+        ) to '{caminho}' (header, delimiter ',');
+    """
+
+    con.sql(query)
+
+
+def gerar(pasta, anos, transacoes_por_mes, semente=0, inicio=datetime.date(2020, 1, 1)):
+    os.makedirs(f'{pasta}/extracts', exist_ok=True)
+    os.makedirs(f'{pasta}/invoices', exist_ok=True)
+
+    con = duckdb.connect()
+    con.execute('select setseed(?)', [semente / (abs(semente) + 1)])
+
+    for mes in meses(anos, inicio):
+        gerar_extrato(con, f'{pasta}/extracts/NU_{mes:%Y-%m}.csv', mes, transacoes_por_mes, semente)
+        gerar_fatura(con, f'{pasta}/invoices/Nubank_{mes:%Y-%m}.csv', mes, transacoes_por_mes)
+
+    con.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Gera extratos e faturas sintéticos no formato exportado pelo Nubank.')
+    parser.add_argument('pasta', help='Pasta onde serão criadas as subpastas extracts/ e invoices/')
+    parser.add_argument('--anos', type=int, default=3)
+    parser.add_argument('--transacoes-por-mes', type=int, default=200)
+    parser.add_argument('--semente', type=int, default=0)
+    args = parser.parse_args()
+
+    gerar(args.pasta, args.anos, args.transacoes_por_mes, args.semente)
@@ -1,4 +1,191 @@
+import argparse
+import bisect
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unicodedata
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
 import duckdb
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+PARQUET = 'data/parquet'
+TENANTS = 'tenants'
+
+CONFIG_ENVIRONMENT = {
+    'threads': 'INGEST_THREADS',
+    'memory_limit': 'INGEST_MEMORY_LIMIT',
+    'temp_directory': 'INGEST_TEMP_DIRECTORY',
+    'batch_files': 'INGEST_BATCH_FILES',
+}
+
+
+class RefreshError(Exception):
+    pass
+
+
+class FileLoadError(RefreshError):
+    def __init__(self, path, message):
+        super().__init__(f'{path}: {message}')
+        self.path = path
+
+
+class DatabaseError(RefreshError):
+    pass
+
+
+class ConfigError(RefreshError):
+    pass
+
+
+class RuleError(RefreshError):
+    pass
+
+
+class RefreshCancelled(RefreshError):
+    def __init__(self):
+        super().__init__('refresh cancelled, the previous database was kept')
+
+
+@dataclass
+class IngestConfig:
+    threads: int = None
+    memory_limit: str = None
+    temp_directory: str = None
+    batch_files: int = 20
+
+    def connection(self):
+        settings = {'threads': self.threads, 'memory_limit': self.memory_limit, 'temp_directory': self.temp_directory}
+        return {name: value for name, value in settings.items() if value is not None}
+
+
+@dataclass(frozen=True)
+class Storage:
+    root: str = ''
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    @property
+    def database(self):
+        return self.path('finance.db')
+
+    @property
+    def parquet(self):
+        return self.path(PARQUET)
+
+    @property
+    def rules(self):
+        return self.path('categories.json')
+
+    def folder(self, source):
+        return self.path('data', f'{source}s')
+
+
+def tenant_storage(tenant=None):
+    # Sem inquilino, a base e os arquivos ficam na raiz do projeto, como numa instalação de um só usuário
+    if tenant is None:
+        return Storage()
+    if not re.fullmatch(r'[A-Za-z0-9][A-Za-z0-9_-]{0,63}', tenant):
+        raise ValueError(f'invalid tenant name: {tenant!r}')
+    return Storage(os.path.join(TENANTS, tenant))
+
+
+@dataclass
+class RefreshResult:
+    files_loaded: list = field(default_factory=list)
+    files_removed: list = field(default_factory=list)
+    rows: dict = field(default_factory=dict)
+    durations: dict = field(default_factory=dict)
+    errors: list = field(default_factory=list)
+    batches: list = field(default_factory=list)
+
+    @property
+    def ok(self):
+        return not self.errors
+
+
+@contextmanager
+def timed(result, phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        result.durations[phase] = result.durations.get(phase, 0.0) + time.perf_counter() - start
+
+
+def load_config(path=None):
+    # O arquivo JSON é opcional e as variáveis de ambiente têm precedência sobre ele
+    path = path or os.environ.get('INGEST_CONFIG', 'ingest.json')
+    values = {}
+    if os.path.exists(path):
+        try:
+            with open(path) as f:
+                values = json.load(f)
+        except (OSError, ValueError) as e:
+            raise ConfigError(f'{path}: {e}')
+
+    for name, variable in CONFIG_ENVIRONMENT.items():
+        if os.environ.get(variable):
+            values[name] = os.environ[variable]
+
+    unknown = set(values) - set(CONFIG_ENVIRONMENT)
+    if unknown:
+        raise ConfigError(f"unknown ingest settings: {', '.join(sorted(unknown))}")
+
+    try:
+        for name in ('threads', 'batch_files'):
+            if values.get(name) is not None:
+                values[name] = int(values[name])
+    except ValueError as e:
+        raise ConfigError(f'{name}: {e}')
+
+    config = IngestConfig(**values)
+    if config.batch_files < 1 or (config.threads is not None and config.threads < 1):
+        raise ConfigError('threads and batch_files must be at least 1')
+    return config
+
+
+def duckdb_memory(con):
+    return con.sql('select coalesce(sum(memory_usage_bytes), 0) from duckdb_memory()').fetchone()[0]
+
+
+def process_rss():
+    # RSS atual do processo, e não o pico de toda a vida dele como o ru_maxrss; só disponível no Linux
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def record_batch(result, source, files, rows, seconds, memory, rss):
+    size = sum(file[1] for file in files)
+    result.batches.append({
+        'source': source,
+        'files': len(files),
+        'rows': rows,
+        'bytes': size,
+        'seconds': seconds,
+        'rows_per_second': rows / seconds if seconds else None,
+        'mb_per_second': size / 2**20 / seconds if seconds else None,
+        'duckdb_peak_memory': memory,
+        'rss_change': rss,
+    })
 
 
 def run_scripts(con, **kwargs):
@@ -6,74 +193,1082 @@ def run_scripts(con, **kwargs):
         con.sql(kwargs[key])
 
 
-def extract(con):
-    drop = "drop table if exists original_extract;"
+def manifest(con):
+    schema = """
+        create table if not exists loaded_files (
+            path varchar
+        ,   source varchar
+        ,   size bigint
+        ,   mtime double
+        ,   hash varchar
+        ,   rows bigint
+        ,   loaded_at timestamp
+        );
+
+        create table if not exists search_indexes (
+            name varchar primary key
+        ,   unsorted bigint
+        );
+    """
+
+    generation = """
+        create table if not exists metadata (
+            generation bigint
+        );
+
+        insert into metadata
+        select 0 where not exists (select * from metadata);
+    """
+
+    # Palavras em minúsculas e sem acentos, usadas no índice de busca e para quebrar o texto buscado
+    tokenize = """
+        create or replace macro tokenize(text) as
+            list_filter(regexp_split_to_array(lower(strip_accents(text)), '[^a-z0-9]+'), token -> length(token) > 1);
+    """
+
+    run_scripts(con, schema=schema, generation=generation, tokenize=tokenize)
+
+
+def file_hash(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def scan_files(con, source, folder, paths=None):
+    query = 'select path, size, mtime, hash from loaded_files where source = ?'
+    known = {path: (size, mtime, digest) for path, size, mtime, digest in con.execute(query, [source]).fetchall()}
+
+    # Com paths, só esses arquivos são verificados, e os demais ficam como estão na base
+    if paths is not None:
+        known = {path: value for path, value in known.items() if path in paths}
+
+    changed = []
+    names = sorted(os.listdir(folder)) if os.path.isdir(folder) else []
+    for name in names:
+        if not name.endswith('.csv'):
+            continue
+
+        path = f'{folder}/{name}'
+        if paths is not None and path not in paths:
+            continue
+
+        # Um arquivo apagado entre a listagem e a leitura é tratado como ausente, e sai da base se já estava nela
+        try:
+            stat = os.stat(path)
+            previous = known.get(path)
+            if previous and previous[:2] == (stat.st_size, stat.st_mtime):
+                known.pop(path)
+                continue
+            digest = file_hash(path)
+        except FileNotFoundError:
+            continue
+        known.pop(path, None)
+
+        if previous and previous[2] == digest:
+            con.execute('update loaded_files set mtime = ? where path = ?', [stat.st_mtime, path])
+            continue
+
+        changed.append((path, stat.st_size, stat.st_mtime, digest))
+
+    removed = sorted(known)
+    return changed, removed
+
+
+def needs_transform(con, tables, changed, removed):
+    return bool(changed or removed) or not all(table_exists(con, table) for table in tables)
+
+
+def storage_key(path, digest):
+    return hashlib.sha256(f'{path}:{digest}'.encode()).hexdigest()[:24]
+
+
+def write_parquet(con, storage, source, path, digest):
+    query = f"""
+        copy (
+            select *, year(date) as year, month(date) as month
+            from staging
+            where file = ?
+        ) to '{storage.parquet}/{source}' (
+            format parquet
+        ,   compression zstd
+        ,   partition_by (year, month)
+        ,   filename_pattern '{storage_key(path, digest)}_{{i}}'
+        ,   overwrite_or_ignore
+        );
+    """
+
+    os.makedirs(f'{storage.parquet}/{source}', exist_ok=True)
+    con.execute(query, [path])
+
+
+def parquet_files(con, storage, source, keys=None):
+    if keys is None:
+        query = 'select path, hash from loaded_files where source = ?'
+        keys = {storage_key(path, digest) for path, digest in con.execute(query, [source]).fetchall()}
+
+    files = glob.glob(f'{storage.parquet}/{source}/*/*/*.parquet')
+    return sorted(file for file in files if os.path.basename(file).rsplit('_', 1)[0] in keys)
+
+
+def read_files(con, files):
+    if files:
+        paths = ', '.join("'" + file.replace("'", "''") + "'" for file in files)
+        return f'select * from read_parquet([{paths}], hive_partitioning = true)'
+
+    columns = ', '.join(f'null::{kind} as {name}' for name, kind, *_ in con.sql('describe staging').fetchall())
+    return f'select {columns}, null::bigint as year, null::bigint as month limit 0'
+
+
+def create_view(con, storage, source, table):
+    con.sql(f'create or replace view {table} as {read_files(con, parquet_files(con, storage, source))};')
+
+
+def cleanup(storage, keep):
+    for file in glob.glob(f'{storage.parquet}/*/*/*/*.parquet'):
+        if file in keep:
+            continue
+        os.remove(file)
+
+        for folder in (os.path.dirname(file), os.path.dirname(os.path.dirname(file))):
+            if not os.listdir(folder):
+                os.rmdir(folder)
+
+
+def table_exists(con, table):
+    query = 'select count(*) from information_schema.tables where table_name = ?'
+    return con.execute(query, [table]).fetchone()[0] > 0
+
+
+def table_columns(con, table):
+    query = 'select column_name from information_schema.columns where table_name = ?'
+    return [row[0] for row in con.execute(query, [table]).fetchall()]
+
+
+def column_type(con, table, column):
+    query = 'select data_type from information_schema.columns where table_name = ? and column_name = ?'
+    row = con.execute(query, [table, column]).fetchone()
+    return row[0] if row else None
+
+
+def ingest(con, result, progress, storage, config, paths, source, table, schema, copy, key, **transforms):
+    with timed(result, 'schema'):
+        run_scripts(con, schema=schema)
+
+        # Versões anteriores guardavam as linhas dos CSVs numa tabela dentro da própria base, ou em
+        # Parquet sem a coluna de chave (ou com a chave em texto), e nesses casos todos os arquivos são convertidos
+        # de novo
+        key_type = column_type(con, 'staging', 'key')
+        kind = con.execute('select table_type from information_schema.tables where table_name = ?', [table]).fetchone()
+        if kind and (kind[0] == 'BASE TABLE' or column_type(con, table, 'key') != key_type):
+            con.sql(f"drop {'table' if kind[0] == 'BASE TABLE' else 'view'} {table};")
+            con.execute('delete from loaded_files where source = ?', [source])
+
+        # e as tabelas derivadas não tinham chave, ou tinham uma de outro tipo, então são reconstruídas uma vez
+        # a partir dos arquivos, junto com as demais tabelas que dependem delas
+        query = "select count(*) from duckdb_constraints() where table_name = ? and constraint_type = 'PRIMARY KEY'"
+        if table_exists(con, source) and (con.execute(query, [source]).fetchone()[0] == 0
+                                          or column_type(con, source, 'id') != key_type):
+            con.sql(f'drop table {source};')
+        if not table_exists(con, source):
+            for name in transforms:
+                con.sql(f'drop table if exists {name};')
+
+    with timed(result, 'scan'):
+        changed, removed = scan_files(con, source, storage.folder(source), paths)
+
+    # Os arquivos são convertidos fora da transação para que um CSV inválido não aborte os demais, em lotes
+    # de batch_files arquivos; ao fim de cada lote a staging é esvaziada, e a memória não cresce com o total
+    loaded = []
+    rows = {}
+    for start in range(0, len(changed), config.batch_files):
+        batch = []
+        started = time.perf_counter()
+        rss = process_rss()
+        # Maior uso de memória do DuckDB medido depois de cada arquivo do lote
+        peak = duckdb_memory(con)
+        for position, (path, size, mtime, digest) in enumerate(changed[start:start + config.batch_files], start + 1):
+            if progress:
+                progress(source, path, position, len(changed))
+            with timed(result, 'copy'):
+                try:
+                    con.sql(copy.format(path=path.replace("'", "''")))
+                except duckdb.Error as e:
+                    result.errors.append(FileLoadError(path, e))
+                    continue
+                con.execute('update staging set file = ? where file is null', [path])
+                con.execute(f"""
+                    update staging set key = keyed.key
+                    from (select rowid as row, {key} as key from staging where file = ?) keyed
+                    where staging.rowid = keyed.row
+                """, [path])
+                write_parquet(con, storage, source, path, digest)
+                rows[path] = con.execute('select count(*) from staging where file = ?', [path]).fetchone()[0]
+                peak = max(peak, duckdb_memory(con))
+            batch.append((path, size, mtime, digest))
+
+        con.sql('delete from staging;')
+        rss = process_rss() - rss if rss is not None else None
+        record_batch(result, source, batch, sum(rows[file[0]] for file in batch), time.perf_counter() - started,
+                     peak, rss)
+        loaded += batch
+
+    con.begin()
+
+    with timed(result, 'drop'):
+        # Versões anteriores dos arquivos removidos ou alterados, cujas chaves podem ter saído da base
+        query = 'select path, hash from loaded_files where source = ? and path in (select unnest(?::varchar[]))'
+        previous = con.execute(query, [source, removed + [file[0] for file in loaded]]).fetchall()
+        previous = parquet_files(con, storage, source, {storage_key(path, digest) for path, digest in previous})
+
+        for path in removed + [file[0] for file in loaded]:
+            con.execute('delete from loaded_files where path = ?', [path])
+
+    with timed(result, 'copy'):
+        for path, size, mtime, digest in loaded:
+            con.execute('insert into loaded_files values (?, ?, ?, ?, ?, ?, now())',
+                        [path, source, size, mtime, digest, rows[path]])
+        create_view(con, storage, source, table)
+
+    # Linhas dos arquivos que precisam ser inseridas (ou atualizadas) nas tabelas derivadas, lidas só dos
+    # arquivos novos e alterados, e chaves que não estão em mais nenhum arquivo, a serem removidas. Só quando
+    # há arquivos removidos ou alterados as chaves dos demais arquivos são lidas, e apenas essa coluna
+    with timed(result, 'pending'):
+        if table_exists(con, source):
+            pending = parquet_files(con, storage, source, {storage_key(file[0], file[3]) for file in loaded})
+        else:
+            pending = parquet_files(con, storage, source)
+        con.sql(f'create or replace temp table pending_rows as {read_files(con, pending)};')
+
+        if previous and table_exists(con, source):
+            con.sql(f"""
+                create or replace temp table dropped as
+                select distinct key from ({read_files(con, previous)})
+                where key not in (select key from {table} where key is not null);
+            """)
+        else:
+            con.sql('create or replace temp table dropped as select key from staging limit 0;')
+
+    with timed(result, 'transform'):
+        if needs_transform(con, transforms, loaded, removed):
+            run_scripts(con, **transforms)
+
+    # Invalida os caches das páginas, que usam a geração como parte da chave
+    if loaded or removed:
+        con.sql('update metadata set generation = generation + 1;')
+
+    con.commit()
+
+    result.files_loaded += [file[0] for file in loaded]
+    result.files_removed += removed
+    result.rows[table] = con.sql(f'select count(*) from {table}').fetchone()[0]
+    result.rows[source] = con.sql(f'select count(*) from {source}').fetchone()[0]
 
+
+RULE_FIELDS = {'category', 'description', 'counterpart', 'min_value', 'max_value'}
+
+
+def load_rules(path):
+    # Regras em ordem de prioridade, por exemplo:
+    # [{"category": "Mercado", "description": "pix", "counterpart": "supermercado", "max_value": 0}]
+    if not os.path.exists(path):
+        return []
+
+    try:
+        with open(path) as f:
+            rules = json.load(f)
+    except (OSError, ValueError) as e:
+        raise RuleError(f'{path}: {e}')
+
+    if not isinstance(rules, list):
+        raise RuleError(f'{path}: expected a list of rules')
+    return rules
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', text or '').encode('ascii', 'ignore').decode()
+    return ' '.join(text.lower().split())
+
+
+class CategoryMatcher:
+    def __init__(self, rules):
+        self.rules = rules
+        self.patterns = []
+        for position, rule in enumerate(rules):
+            if not isinstance(rule, dict) or not rule.get('category') or set(rule) - RULE_FIELDS:
+                raise RuleError(f'rule {position + 1} needs a category and accepts only {sorted(RULE_FIELDS)}')
+            if any(not isinstance(rule.get(name, 0), (int, float)) for name in ('min_value', 'max_value')):
+                raise RuleError(f"rule {position + 1} ({rule['category']}): min_value and max_value must be numbers")
+
+            # Cada campo é procurado no próprio texto, então ^ e $ marcam o início e o fim da descrição ou da
+            # contraparte; um campo vazio atende qualquer transação
+            fields = []
+            for name in ('description', 'counterpart'):
+                if not rule.get(name):
+                    fields.append(None)
+                    continue
+                try:
+                    fields.append(re.compile(rule[name], re.IGNORECASE).search)
+                except re.error as e:
+                    raise RuleError(f"rule {position + 1} ({rule['category']}): {e}")
+            self.patterns.append(tuple(fields))
+
+        limits = {rule[name] for rule in rules for name in ('min_value', 'max_value') if rule.get(name) is not None}
+        self.limits = sorted(limits)
+        self.matchers = {}
+        self.memo = {}
+
+    def matcher(self, value):
+        # Valores na mesma faixa entre os limites das regras têm as mesmas regras aplicáveis, guardadas em ordem
+        # para cada faixa. As regras são testadas uma a uma, e não combinadas num único regex: a combinação por
+        # campo (com um grupo por regra) não para na primeira regra que casa e ficou mais lenta nos testes
+        band = (bisect.bisect_left(self.limits, value), bisect.bisect_right(self.limits, value))
+        if band not in self.matchers:
+            self.matchers[band] = [
+                (position, *pattern)
+                for position, (rule, pattern) in enumerate(zip(self.rules, self.patterns))
+                if rule.get('min_value') is None or value >= rule['min_value']
+                if rule.get('max_value') is None or value <= rule['max_value']
+            ]
+        return band, self.matchers[band]
+
+    def categorize(self, description, value):
+        band, rules = self.matcher(value)
+        counterpart = description.split(' - ')[1] if description and ' - ' in description else ''
+        description, counterpart = normalize(description), normalize(counterpart)
+
+        # Descrições repetidas (o mesmo estabelecimento, a mesma pessoa) são classificadas uma vez por faixa
+        key = (description, counterpart, band)
+        if key not in self.memo:
+            position = next((position for position, in_description, in_counterpart in rules
+                             if (not in_description or in_description(description))
+                             if (not in_counterpart or in_counterpart(counterpart))), len(self.rules))
+            self.memo[key] = (self.rules[position]['category'] if position < len(self.rules) else None, position)
+        return self.memo[key]
+
+
+def rule_hash(rule):
+    return hashlib.sha256(json.dumps(rule, sort_keys=True).encode()).hexdigest()
+
+
+def categorize(con, result, storage):
+    with timed(result, 'categorize'):
+        try:
+            rules = load_rules(storage.rules)
+            matcher = CategoryMatcher(rules)
+        except RuleError as e:
+            result.errors.append(e)
+            return
+
+        con.sql('create table if not exists category_rules (position integer, hash varchar);')
+        previous = [row[0] for row in con.sql('select hash from category_rules order by position').fetchall()]
+        current = [rule_hash(rule) for rule in rules]
+
+        # Com a primeira correspondência valendo, uma transação classificada por uma regra anterior à primeira
+        # regra alterada não muda; as sem categoria guardam len(regras) e entram sempre que algo mudar
+        changed = next((position for position, (old, new) in enumerate(zip(previous, current)) if old != new),
+                       min(len(previous), len(current)))
+        if previous == current:
+            changed = len(current) + 1
+
+        rows = con.execute('select id, descricao, valor from extract where regra is null or regra >= ?',
+                           [changed]).fetchall()
+        if not rows and previous == current:
+            return
+
+        categories = pd.DataFrame(
+            [(id, *matcher.categorize(description, value)) for id, description, value in rows],
+            columns=['id', 'categoria', 'regra'],
+        )
+
+        con.begin()
+        con.register('categories', categories)
+        con.sql("""
+            update extract set categoria = categories.categoria, regra = categories.regra
+            from categories
+            where extract.id = categories.id;
+        """)
+        con.unregister('categories')
+        con.sql('delete from category_rules;')
+        con.execute('insert into category_rules select unnest(?::integer[]), unnest(?::varchar[])',
+                    [list(range(len(current))), current])
+        con.sql('update metadata set generation = generation + 1;')
+        con.commit()
+
+
+def tokens_query(source, column):
+    # Índice invertido de palavras do texto, para a busca não percorrer o texto de todas as transações; só as
+    # chaves removidas e as dos arquivos novos ou alterados são apagadas, e só essas últimas são quebradas em
+    # palavras de novo (ou todas as transações, quando o índice ainda está vazio). As palavras são gravadas em
+    # ordem, e as acrescentadas a um índice já preenchido são contadas para a reordenação de sort_tokens
+    return f"""
+        create table if not exists {source}_tokens (
+            token varchar
+        ,   id uuid
+        );
+
+        delete from {source}_tokens
+        where
+            id in (select key from dropped)
+            or id in (select key from pending_rows);
+
+        create or replace temp table new_tokens as
+        select distinct
+            unnest(tokenize({column})) as token
+        ,   id
+        from
+            {source}
+        where
+            id in (select key from pending_rows)
+            or not exists (select * from {source}_tokens);
+
+        insert or replace into search_indexes
+        select
+            '{source}_tokens'
+        ,   if(exists (select * from {source}_tokens), coalesce(any_value(unsorted), 0) + (select count(*) from new_tokens), 0)
+        from
+            search_indexes
+        where
+            name = '{source}_tokens';
+
+        insert into {source}_tokens
+        select * from new_tokens order by token, id;
+    """
+
+
+def sort_tokens(con, result, table):
+    # A busca filtra cada palavra por um intervalo de tokens, e com a tabela em ordem o DuckDB pula os blocos fora
+    # dele pelos mínimos e máximos de cada bloco; palavras acrescentadas depois ficam no fim, e quando passam de
+    # 10% do índice (ou num índice gravado antes dessa contagem) a tabela é regravada em ordem
+    with timed(result, 'sort'):
+        row = con.execute('select unsorted from search_indexes where name = ?', [table]).fetchone()
+        if row and row[0] <= 0.1 * con.sql(f'select count(*) from {table}').fetchone()[0]:
+            return
+
+        con.begin()
+        con.sql(f'create or replace table {table} as select * from {table} order by token, id;')
+        con.execute('insert or replace into search_indexes values (?, 0)', [table])
+        con.commit()
+
+
+def distribution_query(source, filters=''):
+    # Estatísticas do boxplot de gastos de cada mês (quartis, bigodes em 1,5 IQR e no máximo 100 outliers, os mais
+    # distantes), para que o gráfico não dependa da quantidade de transações do mês; extrato e fatura usam o mesmo
+    # cálculo e só diferem nos filtros dos gastos
+    return f"""
+        create or replace table {source}_distribution as (
+        with gastos as (
+            select
+                date_trunc('month', data)::date as mes
+            ,   abs(valor) as valor
+            from
+                {source}
+            where
+                valor < 0
+                {filters}
+        ), quartis as (
+            select
+                mes
+            ,   count(*) as quantidade
+            ,   quantile_cont(valor, 0.25) as q1
+            ,   median(valor) as mediana
+            ,   quantile_cont(valor, 0.75) as q3
+            from
+                gastos
+            group by
+                1
+        ), limites as (
+            select
+                *
+            ,   q1 - 1.5 * (q3 - q1) as limite_inferior
+            ,   q3 + 1.5 * (q3 - q1) as limite_superior
+            from
+                quartis
+        )
+        select
+            limites.mes
+        ,   any_value(quantidade) as quantidade
+        ,   any_value(q1) as q1
+        ,   any_value(mediana) as mediana
+        ,   any_value(q3) as q3
+        ,   min(valor) filter (where valor >= limite_inferior) as minimo
+        ,   max(valor) filter (where valor <= limite_superior) as maximo
+        ,   coalesce(
+                list(valor order by greatest(valor - q3, q1 - valor) desc)
+                filter (where valor < limite_inferior or valor > limite_superior), []
+            )[1:100] as outliers
+        from
+            limites
+        join
+            gastos using (mes)
+        group by
+            1
+        order by
+            1
+        );
+    """
+
+
+def extract(con, result, progress=None, config=None, storage=None, paths=None):
     schema = """
-        create table original_extract (
+        create or replace temp table staging (
             date date
         ,   value double
         ,   id varchar
         ,   description varchar
+        ,   file varchar
+        ,   key uuid
         );
     """
 
-    copy = "copy original_extract from 'data/extracts/*.csv';"
+    copy = "copy staging (date, value, id, description) from '{path}';"
+
+    # Extratos de períodos sobrepostos repetem transações, que são identificadas pelo id do Nubank, guardado
+    # como uuid (16 bytes em vez de 36 caracteres); um id fora desse formato vira o uuid do seu md5
+    key = 'coalesce(try_cast(id as uuid), md5(id)::uuid)'
 
+    # O saldo acumulado é recalculado apenas a partir da data mais antiga com linhas removidas, novas ou
+    # alteradas (ou ainda sem saldo); quando só chegam transações posteriores, apenas elas são atualizadas.
+    # A posição de cada transação entre as maiores do mês é refeita só nos meses dessas linhas, e as transações
+    # dos arquivos novos ou alterados ficam sem regra, para serem classificadas de novo pelas regras de categoria
     query = """
-        create or replace table extract as (
-        select 
-            id
-        ,   date as data
-        ,	if(position('-' in description) > 0, left(description, position(' -' in description) - 1), description) as tipo
-        ,	value as valor
-        ,	description as descricao
-        from 
-            original_extract
+        create table if not exists extract (
+            id uuid primary key
+        ,   data date
+        ,   tipo varchar
+        ,   valor double
+        ,   descricao varchar
+        ,   saldo double
+        ,   top integer
+        ,   investimento boolean
+        ,   direcao_investimento enum('aplicacao', 'resgate')
+        ,   pagamento_fatura boolean
+        ,   categoria varchar
+        ,   regra integer
+        );
+
+        create or replace temp table affected as
+        select
+            data
+        from
+            extract
+        where
+            id in (select key from dropped)
+        union all
+        select
+            pending.date
+        from
+            pending_rows pending
+        left join
+            extract on extract.id = pending.key
+        where
+            extract.id is null or extract.data <> pending.date or extract.valor <> pending.value
+        union all
+        select
+            extract.data
+        from
+            extract
+        join
+            pending_rows pending on extract.id = pending.key
+        where
+            extract.data <> pending.date or extract.valor <> pending.value;
+
+        delete from extract where id in (select key from dropped);
+
+        create or replace temp table incoming as
+        select
+            *
+        ,   descricao like '%RDB%' or descricao like '%CDB%' as investimento
+        ,   case
+                when tipo in ('Aplicação RDB', 'Compra de CDB') then 'aplicacao'
+                when tipo = 'Resgate RDB' then 'resgate'
+            end as direcao_investimento
+        ,   tipo = 'Pagamento de fatura' as pagamento_fatura
+        ,   null::varchar as categoria
+        ,   null::integer as regra
+        from (
+            select distinct on (key)
+                key as id
+            ,   date as data
+            ,	if(position('-' in description) > 0, left(description, position(' -' in description) - 1), description) as tipo
+            ,	value as valor
+            ,	description as descricao
+            from
+                pending_rows
+            order by
+                key, file
+        );
+
+        create or replace temp table balance_start as
+        select
+            least((select min(data) from affected), (select min(data) from extract where saldo is null)) as data
+        ,   not exists (select * from extract) as full_rebuild;
+
+        -- Na primeira carga (ou quando a tabela é reconstruída por uma migração) o saldo e a posição entre as
+        -- maiores do mês já são calculados no próprio insert, em vez de gravar as linhas e depois atualizar todas elas
+        insert into extract (id, data, tipo, valor, descricao, investimento, direcao_investimento, pagamento_fatura, categoria, regra, saldo, top)
+        select
+            *
+        ,   sum(valor) over (order by data, id) as saldo
+        ,   rank() over (partition by date_trunc('month', data) order by abs(valor) desc) as top
+        from
+            incoming
+        where
+            (select full_rebuild from balance_start);
+
+        insert or replace into extract (id, data, tipo, valor, descricao, investimento, direcao_investimento, pagamento_fatura)
+        select
+            id, data, tipo, valor, descricao, investimento, direcao_investimento, pagamento_fatura
+        from
+            incoming
+        where
+            not (select full_rebuild from balance_start);
+
+        update extract set regra = null
+        where
+            not (select full_rebuild from balance_start)
+            and id in (select id from incoming);
+
+        update extract set saldo = balance.saldo
+        from (
+            select
+                id
+            ,   coalesce((
+                    select saldo from extract
+                    where data < (select data from balance_start)
+                    order by data desc, id desc
+                    limit 1
+                ), 0) + sum(valor) over (order by data, id) as saldo
+            from
+                extract
+            where
+                not (select full_rebuild from balance_start)
+                and data >= (select data from balance_start)
+        ) balance
+        where
+            extract.id = balance.id;
+
+        update extract set top = ranked.top
+        from (
+            select
+                id
+            ,   rank() over (partition by date_trunc('month', data) order by abs(valor) desc) as top
+            from
+                extract
+            where
+                not (select full_rebuild from balance_start)
+                and date_trunc('month', data) in (
+                    select date_trunc('month', data) from affected
+                    union
+                    select date_trunc('month', data) from extract where top is null
+                )
+        ) ranked
+        where
+            extract.id = ranked.id;
+    """
+
+    monthly = """
+        create or replace table extract_monthly as (
+        select
+            date_trunc('month', data)::date as mes
+        ,	sum(if(direcao_investimento = 'aplicacao', valor, 0))*-1 as aplicado
+        ,	sum(if(direcao_investimento = 'resgate', valor, 0))*-1 as resgatado
+        ,	sum(if(direcao_investimento is not null, valor, 0))*-1 as investido
+        ,   sum(if(valor > 0 and direcao_investimento is distinct from 'resgate', valor, 0)) as ganhos
+        ,   sum(if(valor < 0 and direcao_investimento is distinct from 'aplicacao', valor, 0)) as gastos
+        ,   sum(if(direcao_investimento is null, valor, 0)) as sobras
+        ,   sum(if(valor > 0, valor, 0)) as entrada
+        ,   sum(if(valor < 0, valor, 0)) as saida
+        ,   sum(valor) as saldo_mes
+        ,   sum(sum(valor)) over (order by date_trunc('month', data)::date) - sum(valor) as saldo_inicial
+        from
+            extract
+        group by
+            1
+        order by
+            1
+        );
+    """
+
+    daily = """
+        create or replace table extract_daily as (
+        select
+            date_trunc('month', data)::date as mes
+        ,   data
+        ,   count(id) as quantidade
+        ,   abs(sum(valor)) as valor
+        from
+            extract
+        where
+            valor < 0
+            and not investimento
+        group by
+            1, 2
+        order by
+            1, 2
         );
     """
 
-    run_scripts(con, drop=drop, schema=schema, copy=copy, query=query)
+    tokens = tokens_query('extract', 'descricao')
+
+    distribution = distribution_query('extract', 'and not investimento')
+
+    # Bases anteriores não guardavam o saldo acumulado, a posição no mês, a classificação nem a categoria,
+    # e a tabela é refeita a partir de todos os arquivos
+    columns = {'saldo', 'top', 'investimento', 'direcao_investimento', 'pagamento_fatura', 'categoria', 'regra'}
+    if table_exists(con, 'extract') and not columns <= set(table_columns(con, 'extract')):
+        con.sql('drop table extract;')
 
+    ingest(con, result, progress, storage or Storage(), config or IngestConfig(), paths, 'extract', 'original_extract',
+           schema, copy, key,
+           extract=query, extract_monthly=monthly, extract_daily=daily, extract_distribution=distribution,
+           extract_tokens=tokens)
+    sort_tokens(con, result, 'extract_tokens')
 
-def invoice(con):
-    drop = "drop table if exists original_invoice;"
 
+def invoice(con, result, progress=None, config=None, storage=None, paths=None):
     schema = """
-        create table original_invoice (
+        create or replace temp table staging (
             date date
         ,   category varchar
         ,   title varchar
         ,   value double
+        ,   file varchar
+        ,   key uuid
         );
     """
 
-    copy = "copy original_invoice from 'data/invoices/*.csv';"
+    copy = "copy staging (date, category, title, value) from '{path}';"
 
+    # Faturas não têm identificador, então a chave é o md5 (como uuid) da data, valor, ordem da repetição dentro do
+    # arquivo e título, para que duas compras iguais no mesmo dia não se confundam. As chaves ficam nos Parquet e são
+    # comparadas com as de arquivos convertidos depois, então não dependem do hash() interno do DuckDB, que pode
+    # mudar entre versões; o título vai por último para que um '|' dentro dele não torne o texto ambíguo
+    key = ("md5(concat_ws('|', date, value::decimal(18, 2), row_number() over (partition by date, title, value), "
+           "title))::uuid")
+
+    # A posição de cada compra entre as maiores do mês é refeita só nos meses com compras removidas ou novas
     query = """
-        create or replace table invoice as (
-        select 
-            date as data
+        create table if not exists invoice (
+            id uuid primary key
+        ,   data date
+        ,   categoria varchar
+        ,   valor double
+        ,   titulo varchar
+        ,   top integer
+        ,   pagamento_fatura boolean
+        );
+
+        create or replace temp table affected as
+        select
+            data
+        from
+            invoice
+        where
+            id in (select key from dropped)
+        union all
+        select
+            pending.date
+        from
+            pending_rows pending
+        left join
+            invoice on invoice.id = pending.key
+        where
+            invoice.id is null;
+
+        delete from invoice where id in (select key from dropped);
+
+        create or replace temp table incoming as
+        select distinct on (key)
+            key as id
+        ,   date as data
         ,	category as categoria
         ,	value*-1 as valor
         ,	title as titulo
-        from 
-            original_invoice
+        ,   title = 'Pagamento recebido' as pagamento_fatura
+        from
+            pending_rows
+        order by
+            key, file;
+
+        create or replace temp table rebuild as
+        select
+            not exists (select * from invoice) as full_rebuild;
+
+        -- Na primeira carga (ou quando a tabela é reconstruída por uma migração) a posição entre as maiores do
+        -- mês já é calculada no próprio insert, em vez de gravar as compras e depois atualizar todas elas
+        insert into invoice (id, data, categoria, valor, titulo, pagamento_fatura, top)
+        select
+            *
+        ,   rank() over (partition by date_trunc('month', data) order by abs(valor) desc) as top
+        from
+            incoming
+        where
+            (select full_rebuild from rebuild);
+
+        insert or replace into invoice (id, data, categoria, valor, titulo, pagamento_fatura)
+        select
+            *
+        from
+            incoming
+        where
+            not (select full_rebuild from rebuild);
+
+        update invoice set top = ranked.top
+        from (
+            select
+                id
+            ,   rank() over (partition by date_trunc('month', data) order by abs(valor) desc) as top
+            from
+                invoice
+            where
+                not (select full_rebuild from rebuild)
+                and date_trunc('month', data) in (
+                    select date_trunc('month', data) from affected
+                    union
+                    select date_trunc('month', data) from invoice where top is null
+                )
+        ) ranked
+        where
+            invoice.id = ranked.id;
+    """
+
+    monthly = """
+        create or replace table invoice_monthly as (
+        select
+            date_trunc('month', data)::date as mes
+        ,   sum(if(valor < 0, valor, 0)) as gastos
+        ,   sum(if(valor > 0, valor, 0)) as pagamento_fatura
+        ,   sum(valor) as saldo_mes
+        from
+            invoice
+        group by
+            1
+        order by
+            1
         );
     """
 
-    run_scripts(con, drop=drop, schema=schema, copy=copy, query=query)
+    daily = """
+        create or replace table invoice_daily as (
+        select
+            date_trunc('month', data)::date as mes
+        ,   data
+        ,   count(*) as quantidade
+        ,   abs(sum(valor)) as valor
+        from
+            invoice
+        where
+            1=1
+            and valor < 0
+        group by
+            1, 2
+        order by
+            1, 2
+        );
+    """
+
+    tokens = tokens_query('invoice', 'titulo')
+
+    distribution = distribution_query('invoice')
+
+    # Bases anteriores não guardavam a posição no mês nem a classificação, e a tabela é refeita
+    # a partir de todos os arquivos
+    if table_exists(con, 'invoice') and not {'top', 'pagamento_fatura'} <= set(table_columns(con, 'invoice')):
+        con.sql('drop table invoice;')
+
+    ingest(con, result, progress, storage or Storage(), config or IngestConfig(), paths, 'invoice', 'original_invoice',
+           schema, copy, key,
+           invoice=query, invoice_monthly=monthly, invoice_daily=daily, invoice_distribution=distribution,
+           invoice_tokens=tokens)
+    sort_tokens(con, result, 'invoice_tokens')
+
+
+def snapshot(database):
+    folder, name = os.path.split(os.path.abspath(database))
+    fd, path = tempfile.mkstemp(prefix=f'.{name}.', suffix='.tmp', dir=folder)
+    os.close(fd)
+
+    if os.path.exists(database):
+        shutil.copyfile(database, path)
+        shutil.copymode(database, path)
+        if os.path.exists(f'{database}.wal'):
+            shutil.copyfile(f'{database}.wal', f'{path}.wal')
+    else:
+        os.remove(path)
+
+    return path
+
+
+def discard(path):
+    for file in (path, f'{path}.wal'):
+        if os.path.exists(file):
+            os.remove(file)
 
 
-def execute():
-    con = duckdb.connect(database='finance.db')
-    
-    extract(con)
-    invoice(con)
-    
-    if con:
-        con.close()
+@contextmanager
+def refresh_lock(storage):
+    # Serializa as atualizações da mesma base entre processos (páginas, terminal e observador de pastas);
+    # sem fcntl, como no Windows, cabe a quem usa não atualizar a mesma base ao mesmo tempo
+    if fcntl is None:
+        yield
+        return
+
+    with open(storage.path('.refresh.lock'), 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def refresh(storage=None, progress=None, config=None, cancel=None, paths=None):
+    result = RefreshResult()
+    storage = storage or Storage()
+    database = storage.database
+
+    # O cancelamento é verificado antes de cada arquivo e entre as etapas, e descarta a cópia da base
+    def checkpoint(*args):
+        if cancel is not None and cancel.is_set():
+            raise RefreshCancelled()
+        if progress and args:
+            progress(*args)
+
+    try:
+        config = config or load_config()
+    except ConfigError as e:
+        result.errors.append(e)
+        return result
+
+    if storage.root:
+        os.makedirs(storage.root, exist_ok=True)
+
+    with refresh_lock(storage):
+        # A ingestão escreve numa cópia da base, publicada com um rename atômico ao final,
+        # para que as páginas continuem lendo a versão anterior sem travas durante a atualização
+        with timed(result, 'snapshot'):
+            staging = snapshot(database)
+
+        try:
+            con = duckdb.connect(database=staging, config=config.connection())
+        except duckdb.Error as e:
+            discard(staging)
+            result.errors.append(DatabaseError(e))
+            return result
+
+        keep = set()
+        try:
+            with timed(result, 'schema'):
+                manifest(con)
+            extract(con, result, checkpoint, config, storage, paths)
+            checkpoint()
+            categorize(con, result, storage)
+            checkpoint()
+            invoice(con, result, checkpoint, config, storage, paths)
+            checkpoint()
+            keep.update(parquet_files(con, storage, 'extract') + parquet_files(con, storage, 'invoice'))
+        except (duckdb.Error, RefreshCancelled) as e:
+            try:
+                con.rollback()
+            except duckdb.Error:
+                pass
+            result.errors.append(e if isinstance(e, RefreshCancelled) else DatabaseError(e))
+        except BaseException:
+            # Qualquer outra falha (um erro inesperado, ou a interrupção do processo) também descarta a cópia
+            con.close()
+            discard(staging)
+            raise
+        finally:
+            con.close()
+
+        if any(isinstance(error, (DatabaseError, RefreshCancelled)) for error in result.errors):
+            discard(staging)
+        else:
+            with timed(result, 'publish'):
+                if os.path.exists(f'{database}.wal'):
+                    os.remove(f'{database}.wal')
+                os.replace(staging, database)
+                cleanup(storage, keep)
+
+    return result
+
+
+class RefreshJob:
+    def __init__(self, storage, config=None):
+        self.storage = storage
+        self.config = config
+        self.cancelled = threading.Event()
+        self.files = []
+        self.totals = {}
+        self.result = None
+        self.started = time.time()
+        self.finished = None
+        self.thread = threading.Thread(target=self.run, name=f'refresh {storage.database}', daemon=True)
+
+    def run(self):
+        try:
+            self.result = refresh(self.storage, self.report, self.config, self.cancelled)
+        except Exception as e:
+            self.result = RefreshResult(errors=[e])
+        finally:
+            self.finished = time.time()
+
+    def report(self, source, path, position, total):
+        self.files.append((source, path))
+        self.totals[source] = (position, total)
+
+    def cancel(self):
+        self.cancelled.set()
+
+    @property
+    def done(self):
+        return self.finished is not None
+
+
+class JobRegistry:
+    def __init__(self):
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def start(self, storage, config=None):
+        # Uma única atualização por base: enquanto a anterior não termina, ela mesma é devolvida
+        with self.lock:
+            job = self.jobs.get(storage.database)
+            if job is None or job.done:
+                job = self.jobs[storage.database] = RefreshJob(storage, config)
+                job.thread.start()
+            return job
+
+    def get(self, storage):
+        with self.lock:
+            return self.jobs.get(storage.database)
+
+
+def execute(storage=None, paths=None):
+    result = refresh(storage, paths=paths)
+
+    for batch in result.batches:
+        print(f"{batch['source']}: {batch['files']} files, {batch['rows']} rows in {batch['seconds']:.2f}s "
+              f"({batch['rows_per_second'] or 0:.0f} rows/s, {batch['mb_per_second'] or 0:.1f} MB/s), "
+              f"peak DuckDB memory {batch['duckdb_peak_memory'] / 2**20:.0f} MB"
+              + (f", RSS change {batch['rss_change'] / 2**20:+.0f} MB" if batch['rss_change'] is not None else ''))
+
+    for error in result.errors:
+        print(error, file=sys.stderr)
+
+    return result
 
 
 if __name__ == '__main__':
-    execute()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Loads the Nubank CSV files into the DuckDB database.')
+    parser.add_argument('--tenant', help='Updates the database and files of this tenant, under tenants/')
+    args = parser.parse_args()
+
+    try:
+        storage = tenant_storage(args.tenant)
+    except ValueError as e:
+        parser.error(str(e))
+
+    sys.exit(0 if execute(storage).ok else 1)
@@ -0,0 +1,100 @@
+import argparse
+import os
+import sys
+import time
+
+from database.main import DatabaseError, RefreshCancelled, execute, tenant_storage
+
+
+SOURCES = ('extract', 'invoice')
+
+
+class DirectoryWatcher:
+    def __init__(self, storage, interval=2.0, debounce=10.0):
+        self.storage = storage
+        self.interval = interval
+        self.debounce = debounce
+        self.files = self.scan()
+        self.affected = set()
+        self.changed = None
+
+    def scan(self):
+        # Só entram CSVs visíveis: temporários, downloads parciais e arquivos ocultos usados pela
+        # sincronização (e pelo envio das páginas) enquanto gravam são ignorados
+        files = {}
+        for source in SOURCES:
+            folder = self.storage.folder(source)
+            names = os.listdir(folder) if os.path.isdir(folder) else []
+            for name in names:
+                if name.startswith('.') or not name.endswith('.csv'):
+                    continue
+                path = f'{folder}/{name}'
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files[path] = (stat.st_size, stat.st_mtime_ns)
+        return files
+
+    def poll(self):
+        files = self.scan()
+        affected = {path for path in files.keys() | self.files.keys() if files.get(path) != self.files.get(path)}
+        self.files = files
+
+        if affected:
+            self.affected |= affected
+            self.changed = time.monotonic()
+
+        # Uma rajada de eventos só é carregada depois de debounce segundos sem mudanças, o que também
+        # espera arquivos ainda sendo escritos ficarem com tamanho e data estáveis
+        if not self.affected or time.monotonic() - self.changed < self.debounce:
+            return None
+
+        paths, self.affected = self.affected, set()
+        return paths
+
+    def load(self, paths=None):
+        # Uma falha não encerra o observador; só a perda da atualização inteira (erro da base ou exceção) pede
+        # uma nova tentativa, já que um CSV inválido continua inválido até o arquivo mudar
+        try:
+            result = execute(self.storage, paths)
+        except Exception as e:
+            print(f'Refresh failed: {e!r}', file=sys.stderr)
+            return False
+        return not any(isinstance(error, (DatabaseError, RefreshCancelled)) for error in result.errors)
+
+    def run(self):
+        # Carrega o que mudou enquanto o observador estava parado
+        while not self.load():
+            print(f'Retrying in {self.debounce:g}s', file=sys.stderr)
+            time.sleep(self.debounce)
+
+        while True:
+            time.sleep(self.interval)
+            paths = self.poll()
+            if paths:
+                print(f'{len(paths)} file(s) changed: {", ".join(sorted(paths))}')
+                if not self.load(paths):
+                    # Os arquivos voltam para a fila e são carregados de novo depois de debounce segundos
+                    print(f'Retrying in {self.debounce:g}s', file=sys.stderr)
+                    self.affected |= paths
+                    self.changed = time.monotonic()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Watches the data folders and loads new or changed CSV files.')
+    parser.add_argument('--tenant', help='Watches the files of this tenant, under tenants/')
+    parser.add_argument('--interval', type=float, default=2.0, help='Seconds between folder scans')
+    parser.add_argument('--debounce', type=float, default=10.0,
+                        help='Seconds without changes before the changed files are loaded')
+    args = parser.parse_args()
+
+    try:
+        storage = tenant_storage(args.tenant)
+    except ValueError as e:
+        parser.error(str(e))
+
+    try:
+        DirectoryWatcher(storage, args.interval, args.debounce).run()
+    except KeyboardInterrupt:
+        sys.exit(0)
@@ -10,7 +10,7 @@ texto = '''
     ##### Sobre o menu de navegação de páginas ao lado:
     
     1. **Geranciador de Arquivos:**   
-        Na página de **Gerenciamento de Arquivos**, você deverá **carregar e/ou excluir arquivos**, esses arquivos serão responsáveis pelos dados visualizados nas outras 2 páginas (Extrato e Fatura).   
+        Na página de **Gerenciamento de Arquivos**, você deverá **carregar e/ou excluir arquivos**, esses arquivos serão responsáveis pelos dados visualizados nas outras páginas (Extrato, Fatura e Tendência).   
         Esses arquivos nada mais são que seu **extrato da conta** e **fatura do crédito**,   
         
         O primeiro pode ser pedido no aplicativo da :violet[Nubank], que chegando no seu email você deverá escolher o arquivo no formato csv para baixar e carregá-lo na aba correspondente. <br>
@@ -31,7 +31,7 @@ texto = '''
 
     
     2. **Dashboards:**   
-        Com os arquivos carregados e a atualização da base dados feita, será possível ver os cálculos e análises nas 2 páginas de Dashboards.   
+        Com os arquivos carregados e a atualização da base dados feita, será possível ver os cálculos e análises nas páginas de Dashboards.   
         Nas visualizações de tabelas passe o mouse no nome das coluna para ver mais detalhes sobre elas.   
 
         Páginas de Dashboards:   
@@ -39,6 +39,8 @@ texto = '''
             Essa página será responsável por lhe mostrar cálculos e análises referentes ao seu extrato da conta.
         - **Fatura:**   
             Essa página será responsável por lhe mostrar cálculos e análises referentes à sua fatura de crédito.
+        - **Tendência:**   
+            Essa página mostra a evolução dos gastos diários ou semanais do extrato e da fatura ao longo de todo o histórico, ou de um período escolhido.
 '''
 
 st.markdown(texto, unsafe_allow_html=True)
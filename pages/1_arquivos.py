@@ -1,24 +1,29 @@
-import subprocess
 import streamlit as st
 
-from pages.utils.arquivos import mostrar_arquivos_selecionados, escrever_arquivos
+from database.main import tenant_storage
+from pages.utils.arquivos import (mostrar_arquivos_selecionados, escrever_arquivos, editar_regras,
+                                  registro_atualizacoes, acompanhar_atualizacao)
+from pages.utils.conexao import usuario_atual
 
 
 st.set_page_config(page_title='Gerenciador de Arquivos', layout='wide')
 
+usuario = usuario_atual()
+armazenamento = tenant_storage(usuario)
+
 ######################################################################
 
 st.markdown('### Após carregar e/ou excluir arquivos, clique no botão abaixo:')
 
-if st.button('Atualizar Base de Dados'):
-    try:
-        resultado = subprocess.run(['python3', 'database/main.py'], capture_output=True, text=True)
-        if resultado.stderr:
-            st.error(f'Erro ao Atualizar os Dados - {resultado.stderr}', icon='❌')    
-        else:
-            st.success('Dados Atualizados com Sucesso!', icon='✅')
-    except Exception as e:
-        st.error(f'Erro ao Atualizar os Dados - {e}', icon='❌')
+registro = registro_atualizacoes()
+tarefa = registro.get(armazenamento)
+
+# Cliques repetidos, de qualquer sessão, acompanham a atualização que já está em andamento
+if st.button('Atualizar Base de Dados', disabled=tarefa is not None and not tarefa.done):
+    tarefa = registro.start(armazenamento)
+
+# O andamento é acompanhado ao fim da página, para que o envio de arquivos e as regras fiquem disponíveis
+painel_atualizacao = st.container()
 
 st.divider()
 
@@ -26,11 +31,22 @@ st.divider()
 
 st.markdown('## Carregar Arquivos')
 
-extratos = st.file_uploader('Extratos da Conta', type=['csv'], accept_multiple_files=True)
-escrever_arquivos('./data/extracts', extratos)
+# Os envios são separados por usuário: sem a chave, trocar de usuário manteria os arquivos do anterior no widget
+extratos = st.file_uploader('Extratos da Conta', type=['csv'], accept_multiple_files=True, key=f'extratos_{usuario}')
+escrever_arquivos(armazenamento.folder('extract'), extratos)
+
+faturas = st.file_uploader('Faturas de Crédito', type=['csv'], accept_multiple_files=True, key=f'faturas_{usuario}')
+escrever_arquivos(armazenamento.folder('invoice'), faturas)
+
+st.divider()
+
+######################################################################
+
+st.markdown('## Regras de Categoria')
+st.caption('As transações do extrato recebem a categoria da primeira regra cujas condições preenchidas '
+           'forem todas atendidas; os valores são comparados com sinal, gastos são negativos.')
 
-faturas = st.file_uploader('Faturas de Crédito', type=['csv'], accept_multiple_files=True)
-escrever_arquivos('./data/invoices', faturas)
+editar_regras(armazenamento.rules)
 
 st.divider()
 
@@ -39,10 +55,16 @@ st.divider()
 st.markdown('## Excluir Arquivos')
 
 pastas = {
-    'Extratos da Conta': './data/extracts', 
-    'Faturas de Crédito': './data/invoices'
+    'Extratos da Conta': armazenamento.folder('extract'),
+    'Faturas de Crédito': armazenamento.folder('invoice')
 }
 pasta_selecionada = st.selectbox('Selecione a pasta:', pastas)
 
 if pasta_selecionada:
     mostrar_arquivos_selecionados(pastas[pasta_selecionada])
+
+######################################################################
+
+if tarefa:
+    with painel_atualizacao:
+        acompanhar_atualizacao(tarefa)
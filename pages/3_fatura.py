@@ -2,226 +2,221 @@ import streamlit as st
 import plotly.express as px
 import plotly.graph_objects as go
 import pandas as pd
-import duckdb
 
-from pages.utils.paines import formatar_dinheiro, colorir_celula_valor
+from pages.utils.conexao import Conexao, usuario_atual
+from pages.utils.consultas import (meses_fatura, contar_fatura_do_mes, fatura_do_mes,
+                                   gastos_diarios_fatura, saldos_mensais_fatura,
+                                   distribuicao_gastos_fatura, buscar_fatura)
+from pages.utils.diagnostico import iniciar_diagnostico, mostrar_diagnostico
+from pages.utils.paginacao import controles_paginacao, cursor_pagina, navegacao
+from pages.utils.paines import boxplot, estilizar, para_grafico
 
 
-con = duckdb.connect(database='finance.db')
-
 st.set_page_config(page_title='Fatura de Crédito', layout='wide')
 
+diagnostico_pagina = iniciar_diagnostico('fatura')
+usuario = usuario_atual()
+
+# Blocos em fragmentos, reexecutados sozinhos quando seus filtros e opções mudam, como no extrato
+with Conexao(usuario, diagnostico_pagina) as con:
+    meses = list(meses_fatura(con)['mes'])
+
 ######################################################################
 
-query = """
-    select distinct
-        date_trunc('month', data) as mes
-    from
-        invoice
-"""
+@st.fragment
+def calculos_diarios(meses):
+    st.markdown(f'#### Cálculos Diários')
+    mes_tabela = st.selectbox('Mês', meses, index=len(meses) - 1, key='fatura_mes_tabela')
+
+    tabela_diaria(mes_tabela)
 
-df = con.sql(query).fetchdf().sort_values(['mes'])
-df['mes'] = df['mes'].dt.date
+    diagnostico = iniciar_diagnostico('fatura', diagnostico_pagina)
+    grafico_diario(mes_tabela, diagnostico)
+    mostrar_diagnostico(diagnostico, 'Gastos diários')
 
-meses = list(df['mes'])
-ultimos_meses = meses[-8:]
 
 ######################################################################
 
-st.markdown(f'#### Cálculos Diários')
-mes_tabela = st.sidebar.selectbox('Mês - Filtro Cálculos Diários', meses, index=len(meses) - 1)
+@st.fragment
+def tabela_diaria(mes_tabela):
+    diagnostico = iniciar_diagnostico('fatura', diagnostico_pagina)
+    st.markdown(f'##### Fatura do Mês {mes_tabela}')
 
-######################################################################
+    ordem, decrescente, tamanho = controles_paginacao('fatura')
+    cursor = cursor_pagina('fatura', (usuario, mes_tabela, ordem, decrescente, tamanho))
 
-query = """
-    with aux as (
-        select 
-            *
-        ,   rank() over (partition by date_trunc('month', data) order by abs(valor) desc) as top
-        from
-            invoice
-    )
-    select 
-        date_trunc('month', data) as mes
-    ,   data
-    ,   categoria
-    ,   valor as valor
-    ,   titulo
-    ,   case
-            when top <= 3 then '⭐⭐⭐'
-            when top <= 6 then '⭐⭐'
-            when top <= 10 then '⭐'
-            else ''
-        end as top
-    from 
-        aux
-"""
-
-df = con.sql(query).fetchdf().sort_values(['data'])
-df['data'] = df['data'].dt.date
-df['mes'] = df['mes'].dt.date
-
-
-df = df[df['mes'] == mes_tabela][['data', 'titulo', 'top', 'valor', 'categoria']]
-
-df = df.style.map(colorir_celula_valor, subset=['valor'])
-df = df.format({'valor': formatar_dinheiro})
-
-st.markdown(f'##### Fatura do Mês {mes_tabela}')
-st.dataframe(df, use_container_width=True, hide_index=True,
-             column_config={
-                'data': 'Data',
-                'titulo': 'Título',
-                'top': st.column_config.TextColumn(
-                    'Top 10',
-                    help='⭐ indica as 10 transações com maiores valores'
-                ),
-                'valor': 'Valor',
-                'categoria': 'Categoria'
-             })
+    with Conexao(usuario, diagnostico) as con:
+        total = contar_fatura_do_mes(con, mes_tabela)
+        df = fatura_do_mes(con, mes_tabela, ordem, decrescente, tamanho, cursor)
 
-######################################################################
+    style_df = estilizar(df[['data', 'titulo', 'top', 'valor', 'categoria']], ['valor'])
 
-query = """
-    select 
-        date_trunc('month', data) as mes
-    ,   data
-    ,   count(*) as quantidade
-    ,   abs(sum(valor)) as valor
-    from
-        invoice
-    where
-        1=1 
-        and valor < 0
-    group by 
-        1, 2
-"""
+    st.dataframe(style_df, use_container_width=True, hide_index=True,
+                 column_config={
+                    'data': 'Data',
+                    'titulo': 'Título',
+                    'top': st.column_config.TextColumn(
+                        'Top 10',
+                        help='⭐ indica as 10 transações com maiores valores'
+                    ),
+                    'valor': 'Valor',
+                    'categoria': 'Categoria'
+                 })
 
-df = con.sql(query).fetchdf().sort_values(['data'])
-df['data'] = df['data'].dt.date
-df['mes'] = df['mes'].dt.date
+    navegacao('fatura', df, ordem, total, tamanho)
+    mostrar_diagnostico(diagnostico, 'Fatura do mês')
 
-df = df[df['mes'] == mes_tabela]
 
-st.markdown(f'##### Gastos Diários do Mês {mes_tabela}')
+######################################################################
 
-fig = go.Figure()
+def grafico_diario(mes_tabela, diagnostico):
+    with Conexao(usuario, diagnostico) as con:
+        df = para_grafico(gastos_diarios_fatura(con, mes_tabela))
 
-fig.add_trace(go.Scatter(x=df['data'], y=df['valor'], mode='lines', name='Valor', line=dict(color='#FF6347')))
+    st.markdown(f'##### Gastos Diários do Mês {mes_tabela}')
 
-fig.add_trace(go.Bar(x=df['data'], y=df['quantidade'], name='Quantidade', marker_color='#1E90FF', yaxis='y2', opacity=0.4))
+    fig = go.Figure()
 
-fig.update_layout(
-    yaxis=dict(title='Valor'),
-    yaxis2=dict(title='Quantidade', overlaying='y', side='right'),
-    xaxis_title='Dia', yaxis_title='Valor',
-    legend=dict(orientation='h', yanchor='bottom', y=1.02, xanchor='right', x=0.15),
-)
+    fig.add_trace(go.Scatter(x=df['data'], y=df['valor'], mode='lines', name='Valor', line=dict(color='#FF6347')))
 
-st.plotly_chart(fig, use_container_width=True)
+    fig.add_trace(go.Bar(x=df['data'], y=df['quantidade'], name='Quantidade', marker_color='#1E90FF', yaxis='y2', opacity=0.4))
 
-######################################################################
+    fig.update_layout(
+        yaxis=dict(title='Valor'),
+        yaxis2=dict(title='Quantidade', overlaying='y', side='right'),
+        xaxis_title='Dia', yaxis_title='Valor',
+        legend=dict(orientation='h', yanchor='bottom', y=1.02, xanchor='right', x=0.15),
+    )
 
-st.divider()
+    st.plotly_chart(fig, use_container_width=True)
 
-st.markdown(f'#### Cálculos Mensais')
-meses_graficos = st.sidebar.multiselect('Meses - Filtro Cálculos Mensais', meses, default=ultimos_meses)
 
 ######################################################################
 
-query = """
-    select
-        date_trunc('month', data) as mes
-    ,   sum(if(valor < 0, valor, 0)) as gastos
-    ,   sum(if(valor > 0, valor, 0)) as pagamento_fatura
-    ,   sum(valor) as saldo_mes
-    from 
-        invoice
-    group by 
-        1
-"""
-
-df = con.sql(query).fetchdf()
-df['mes'] = df['mes'].dt.date
-df = df[df['mes'].isin(meses_graficos)]
-
-total_gastos = df['gastos'].sum()
-total_pagamento_fatura = df['pagamento_fatura'].sum()
-total_saldo_mes = df['saldo_mes'].sum()
-
-total_df = pd.DataFrame({'mes': ['Total'], 
-                          'gastos': [total_gastos], 
-                          'pagamento_fatura': [total_pagamento_fatura], 
-                          'saldo_mes': [total_saldo_mes]})
-
-df_com_total = pd.concat([df, total_df], ignore_index=True)
-
-style_df = df_com_total.style.map(colorir_celula_valor, subset=['gastos', 'pagamento_fatura', 'saldo_mes'])
-style_df = style_df.format({'gastos': formatar_dinheiro, 'pagamento_fatura': formatar_dinheiro, 'saldo_mes': formatar_dinheiro})
-
-st.markdown('##### Saldos Mensais')
-st.checkbox('Use a largura do contêiner', value=False, key='use_container_width')
-st.dataframe(style_df, use_container_width=st.session_state.use_container_width, 
-             hide_index=True,
-             column_config={
-                 'mes': 'Mês',
-                 'gastos': st.column_config.Column(
-                     'Gastos',
-                     help='Soma de todos os gastos no crédito do mês, valores positivos na fatura'
-                 ),
-                 'pagamento_fatura': st.column_config.Column(
-                     'Pagamento Fatura',
-                     help='Soma de todos os pagamento da fatura no mês, valores negativos na fatura'
-                 ),
-                 'saldo_mes': st.column_config.Column(
-                     'Saldo do Mês',
-                     help='Soma de todos os valores do mês, subtração do Pagamento Fatura com os Gastos'
-                 )
-                })
+@st.fragment
+def calculos_mensais(meses):
+    st.markdown(f'#### Cálculos Mensais')
+    meses_graficos = st.multiselect('Meses', meses, default=meses[-8:], key='fatura_meses_graficos')
+
+    tabela_mensal(meses_graficos)
+    graficos_mensais(meses_graficos)
+
 
 ######################################################################
 
-col1, col2 = st.columns(2)
+@st.fragment
+def tabela_mensal(meses_graficos):
+    diagnostico = iniciar_diagnostico('fatura', diagnostico_pagina)
+    with Conexao(usuario, diagnostico) as con:
+        df = saldos_mensais_fatura(con, meses_graficos)
+
+    total_gastos = df['gastos'].sum()
+    total_pagamento_fatura = df['pagamento_fatura'].sum()
+    total_saldo_mes = df['saldo_mes'].sum()
+
+    total_df = pd.DataFrame({'mes': ['Total'], 
+                              'gastos': [total_gastos], 
+                              'pagamento_fatura': [total_pagamento_fatura], 
+                              'saldo_mes': [total_saldo_mes]})
+
+    df_com_total = pd.concat([df, total_df], ignore_index=True)
+
+    style_df = estilizar(df_com_total, ['gastos', 'pagamento_fatura', 'saldo_mes'])
+
+    st.markdown('##### Saldos Mensais')
+    st.checkbox('Use a largura do contêiner', value=False, key='use_container_width')
+    st.dataframe(style_df, use_container_width=st.session_state.use_container_width, 
+                 hide_index=True,
+                 column_config={
+                     'mes': 'Mês',
+                     'gastos': st.column_config.Column(
+                         'Gastos',
+                         help='Soma de todos os gastos no crédito do mês, valores positivos na fatura'
+                     ),
+                     'pagamento_fatura': st.column_config.Column(
+                         'Pagamento Fatura',
+                         help='Soma de todos os pagamento da fatura no mês, valores negativos na fatura'
+                     ),
+                     'saldo_mes': st.column_config.Column(
+                         'Saldo do Mês',
+                         help='Soma de todos os valores do mês, subtração do Pagamento Fatura com os Gastos'
+                     )
+                    })
+
+    mostrar_diagnostico(diagnostico, 'Saldos mensais')
+
 
 ######################################################################
 
-df = df.melt(id_vars=['mes'], var_name='movimentacao', value_name='valor')
-df = df[df['movimentacao'].isin(['gastos', 'pagamento_fatura', 'saldo_mes'])]
-df['movimentacao'] = df['movimentacao'].replace({'gastos': 'Gastos', 
-                                                 'pagamento_fatura': 'Pagamento Fatura', 
-                                                 'saldo_mes': 'Saldo do Mês'})
-df['valor'] = df['valor'].abs()
+@st.fragment
+def graficos_mensais(meses_graficos):
+    diagnostico = iniciar_diagnostico('fatura', diagnostico_pagina)
+    with Conexao(usuario, diagnostico) as con:
+        df = saldos_mensais_fatura(con, meses_graficos)
+        distribuicao = distribuicao_gastos_fatura(con, meses_graficos)
 
-colors = {'Gastos': '#008080', 'Pagamento Fatura': '#90EE90', 'Saldo do Mês': '#FFDB99'}
+    col1, col2 = st.columns(2)
+
+    ###################################
+
+    df = df.melt(id_vars=['mes'], var_name='movimentacao', value_name='valor')
+    df = df[df['movimentacao'].isin(['gastos', 'pagamento_fatura', 'saldo_mes'])]
+    df['movimentacao'] = df['movimentacao'].replace({'gastos': 'Gastos', 
+                                                     'pagamento_fatura': 'Pagamento Fatura', 
+                                                     'saldo_mes': 'Saldo do Mês'})
+    df['valor'] = df['valor'].abs()
+
+    colors = {'Gastos': '#008080', 'Pagamento Fatura': '#90EE90', 'Saldo do Mês': '#FFDB99'}
+
+    col1.markdown('##### Movimentações Mensais')
+    fig = px.bar(para_grafico(df), x='mes', y='valor', color='movimentacao', 
+                 barmode='group', color_discrete_map=colors)
+    fig.update_layout(xaxis_title='Mês', yaxis_title='Valor')
+    col1.plotly_chart(fig, use_container_width=True)
+
+    ###################################
+
+    col2.markdown('##### Distribuição dos Gastos Mensais')
+    fig = boxplot(distribuicao, '#FF6347')
+    fig.update_layout(xaxis_title='Mês', yaxis_title='Valor')
+    col2.plotly_chart(fig, use_container_width=True)
+
+    mostrar_diagnostico(diagnostico, 'Gráficos mensais')
 
-col1.markdown('##### Movimentações Mensais')
-fig = px.bar(df, x='mes', y='valor', color='movimentacao', 
-             barmode='group', color_discrete_map=colors)
-fig.update_layout(xaxis_title='Mês', yaxis_title='Valor')
-col1.plotly_chart(fig, use_container_width=True)
 
 ######################################################################
+# Busca de transações
+
+@st.fragment
+def busca_transacoes():
+    diagnostico = iniciar_diagnostico('fatura', diagnostico_pagina)
+    st.markdown('#### Busca de Transações')
+    busca = st.text_input('Buscar', placeholder='Palavras da descrição, por exemplo: pix mercado', key='busca_fatura')
+
+    if busca:
+        with Conexao(usuario, diagnostico) as con:
+            df = buscar_fatura(con, busca)
+        st.dataframe(estilizar(df, ['valor']), use_container_width=True, hide_index=True,
+                     column_config={
+                     'data': 'Data',
+                     'categoria': 'Categoria',
+                     'valor': 'Valor',
+                     'titulo': 'Título'
+                     })
+        st.caption(f'{len(df)} transação(ões) encontrada(s), das mais recentes para as mais antigas, até 100')
+        mostrar_diagnostico(diagnostico, 'Busca')
 
-query = """
-    select 
-        date_trunc('month', data) as mes
-    ,   abs(valor) as valor
-    from 
-        invoice
-    where
-        1=1 
-        and valor < 0
-"""
-
-df = con.sql(query).fetchdf()
-df['mes'] = df['mes'].dt.date
-df = df[df['mes'].isin(meses_graficos)]
-
-col2.markdown('##### Distribuição dos Gastos Mensais')
-fig = px.box(df, x='mes', y='valor', color_discrete_sequence=['#FF6347'])
-fig.update_layout(xaxis_title='Mês', yaxis_title='Valor')
-col2.plotly_chart(fig, use_container_width=True)
 
 ######################################################################
 
-con.close()
+calculos_diarios(meses)
+
+st.divider()
+
+calculos_mensais(meses)
+
+st.divider()
+
+busca_transacoes()
+
+mostrar_diagnostico(diagnostico_pagina)
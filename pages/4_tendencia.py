@@ -0,0 +1,63 @@
+import streamlit as st
+import plotly.graph_objects as go
+import pandas as pd
+
+from pages.utils.conexao import Conexao, usuario_atual
+from pages.utils.consultas import periodo, tendencia_extrato, tendencia_fatura
+from pages.utils.diagnostico import iniciar_diagnostico, mostrar_diagnostico
+from pages.utils.paines import para_grafico
+
+
+st.set_page_config(page_title='Tendência de Gastos', layout='wide')
+
+diagnostico = iniciar_diagnostico('tendencia')
+con = Conexao(usuario_atual(), diagnostico)
+
+######################################################################
+# Criação dos filtros de período
+
+limites = periodo(con)
+if pd.isna(limites['inicio']):
+    st.info('Carregue extratos ou faturas e atualize a base de dados para ver a tendência de gastos.')
+    st.stop()
+
+# Um período menor é consultado de novo com mais resolução, já que os pontos são distribuídos nele
+inicio = st.sidebar.date_input('Início', limites['inicio'], min_value=limites['inicio'], max_value=limites['fim'],
+                               format='DD/MM/YYYY')
+fim = st.sidebar.date_input('Fim', limites['fim'], min_value=inicio, max_value=limites['fim'], format='DD/MM/YYYY')
+granularidade = st.sidebar.radio('Granularidade', ['Diária', 'Semanal'])
+pontos = st.sidebar.slider('Pontos por gráfico', min_value=100, max_value=2000, value=500, step=100,
+                           help='Quantidade de intervalos do período; em cada um ficam o menor e o maior gasto')
+
+semanal = granularidade == 'Semanal'
+titulo = 'Gastos Semanais' if semanal else 'Gastos Diários'
+
+######################################################################
+# Gráficos de tendência
+
+def grafico(df, cor):
+    df = para_grafico(df)
+
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=df['data'], y=df['valor'], mode='lines', name='Valor', line=dict(color=cor),
+                             customdata=df['quantidade'],
+                             hovertemplate='%{x}<br>R$ %{y:.2f}<br>%{customdata} transações'))
+    fig.update_layout(xaxis_title='Semana' if semanal else 'Dia', yaxis_title='Valor')
+    return fig
+
+
+st.markdown(f'##### {titulo} do Extrato')
+df = tendencia_extrato(con, inicio, fim, pontos, semanal)
+st.plotly_chart(grafico(df, '#FF6347'), use_container_width=True)
+st.caption(f'{len(df)} pontos')
+
+st.markdown(f'##### {titulo} da Fatura')
+df = tendencia_fatura(con, inicio, fim, pontos, semanal)
+st.plotly_chart(grafico(df, '#1E90FF'), use_container_width=True)
+st.caption(f'{len(df)} pontos')
+
+######################################################################
+
+mostrar_diagnostico(diagnostico)
+
+con.close()
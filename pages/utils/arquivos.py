@@ -1,13 +1,89 @@
+import hashlib
+import json
 import os
+import shutil
+import tempfile
+import time
+import pandas as pd
 import streamlit as st
 
+from database.main import CategoryMatcher, JobRegistry, RefreshCancelled, RuleError, file_hash, load_rules
+
+
+TAMANHO_BLOCO = 1024 * 1024
+INTERVALO_PROGRESSO = 0.5
+
+
+def hash_arquivo_carregado(arquivo):
+    sha = hashlib.sha256()
+    arquivo.seek(0)
+    for bloco in iter(lambda: arquivo.read(TAMANHO_BLOCO), b''):
+        sha.update(bloco)
+    arquivo.seek(0)
+    return sha.hexdigest()
+
+
+@st.cache_data(max_entries=10000, show_spinner=False)
+def hash_arquivo_gravado(caminho, tamanho, mtime):
+    # Tamanho e data de modificação fazem parte da chave, então um arquivo alterado é lido de novo
+    return file_hash(caminho)
+
+
+def arquivo_identico(pasta, tamanho, digest):
+    # Só arquivos do mesmo tamanho podem ser iguais, e cada um é lido uma única vez enquanto não mudar
+    for nome in listar_arquivos(pasta):
+        caminho = os.path.join(pasta, nome)
+        if not os.path.isfile(caminho):
+            continue
+        stat = os.stat(caminho)
+        if stat.st_size == tamanho and hash_arquivo_gravado(caminho, stat.st_size, stat.st_mtime_ns) == digest:
+            return nome
+    return None
+
+
+def nome_disponivel(pasta, nome):
+    base, extensao = os.path.splitext(nome)
+    versao = 2
+    while os.path.exists(os.path.join(pasta, nome)):
+        nome = f'{base} ({versao}){extensao}'
+        versao += 1
+    return nome
+
+
+def gravar_arquivo(pasta, nome, arquivo):
+    # Grava num temporário e renomeia, para que a atualização da base nunca leia um arquivo pela metade
+    fd, temporario = tempfile.mkstemp(prefix=f'.{nome}.', suffix='.tmp', dir=pasta)
+    with os.fdopen(fd, 'wb') as f:
+        arquivo.seek(0)
+        shutil.copyfileobj(arquivo, f, TAMANHO_BLOCO)
+    os.replace(temporario, os.path.join(pasta, nome))
+
 
 def escrever_arquivos(pasta, arquivos):
     if not os.path.exists(pasta):
         os.makedirs(pasta)
+
+    # O file_uploader devolve a mesma lista a cada rerun, então cada envio é processado uma única vez
+    processados = st.session_state.setdefault('arquivos_processados', set())
+
     for arquivo in arquivos:
-        with open(os.path.join(pasta, arquivo.name), 'wb') as f:
-            f.write(arquivo.getbuffer())
+        if (pasta, arquivo.file_id) in processados:
+            continue
+        processados.add((pasta, arquivo.file_id))
+
+        digest = hash_arquivo_carregado(arquivo)
+        existente = arquivo_identico(pasta, arquivo.size, digest)
+        if existente:
+            st.info(f'O arquivo "{arquivo.name}" já estava carregado como "{existente}".', icon='ℹ️')
+            continue
+
+        nome = nome_disponivel(pasta, arquivo.name)
+        gravar_arquivo(pasta, nome, arquivo)
+
+        if nome != arquivo.name:
+            st.warning(f'Já existia um arquivo "{arquivo.name}" com outro conteúdo, '
+                       f'o novo foi carregado como "{nome}".', icon='⚠️')
+        else:
             st.success(f'O arquivo "{arquivo.name}" foi carregado com sucesso!', icon='✅')
 
 
@@ -29,4 +105,121 @@ def mostrar_arquivos_selecionados(pasta):
     for arquivo in arquivos:
         if st.button(f'Excluir arquivo "{arquivo}"'):
             excluir_arquivo(pasta, arquivo)
-    return arquivos
\ No newline at end of file
+    return arquivos
+
+
+COLUNAS_REGRAS = ['category', 'description', 'counterpart', 'min_value', 'max_value']
+
+
+def gravar_regras(caminho, regras):
+    pasta = os.path.dirname(caminho) or '.'
+    os.makedirs(pasta, exist_ok=True)
+    fd, temporario = tempfile.mkstemp(prefix='.regras.', suffix='.tmp', dir=pasta)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(regras, f, ensure_ascii=False, indent=2)
+    os.replace(temporario, caminho)
+
+
+def editar_regras(caminho):
+    try:
+        regras = load_rules(caminho)
+    except RuleError as e:
+        st.error(f'Regras inválidas - {e}', icon='❌')
+        regras = []
+
+    # Tipos fixos, para que colunas vazias continuem editáveis como texto e número
+    df = pd.DataFrame(regras, columns=COLUNAS_REGRAS).astype({
+        'category': 'string', 'description': 'string', 'counterpart': 'string',
+        'min_value': 'float', 'max_value': 'float'
+    })
+    df = st.data_editor(df, num_rows='dynamic', use_container_width=True, key=f'regras_categoria_{caminho}',
+                        column_config={
+                            'category': st.column_config.TextColumn('Categoria', required=True),
+                            'description': st.column_config.TextColumn(
+                                'Descrição',
+                                help='Expressão regular procurada na descrição, em minúsculas e sem acentos'
+                            ),
+                            'counterpart': st.column_config.TextColumn(
+                                'Contraparte',
+                                help='Expressão regular procurada na contraparte, o nome entre o primeiro e o '
+                                     'segundo " - " da descrição'
+                            ),
+                            'min_value': st.column_config.NumberColumn('Valor Mínimo', format='%.2f'),
+                            'max_value': st.column_config.NumberColumn('Valor Máximo', format='%.2f')
+                        })
+
+    if st.button('Salvar Regras'):
+        # Células vazias não entram na regra
+        regras = [
+            {coluna: valor for coluna, valor in linha.items() if not pd.isna(valor) and valor != ''}
+            for linha in df.to_dict('records')
+        ]
+        try:
+            CategoryMatcher(regras)
+        except RuleError as e:
+            st.error(f'Regras inválidas - {e}', icon='❌')
+            return
+
+        gravar_regras(caminho, regras)
+        st.success('Regras salvas! Atualize a base de dados para aplicá-las.', icon='✅')
+
+
+@st.cache_resource
+def registro_atualizacoes():
+    return JobRegistry()
+
+
+def mostrar_progresso(tarefa, barra, atual):
+    feitos = sum(posicao for posicao, total in tarefa.totals.values())
+    total = sum(total for posicao, total in tarefa.totals.values())
+    barra.progress(feitos / total if total else 0.0)
+    if tarefa.cancelled.is_set():
+        atual.caption('Cancelando...')
+    elif tarefa.files:
+        origem, arquivo = tarefa.files[-1]
+        atual.caption(f'Carregando "{os.path.basename(arquivo)}" ({feitos} de {total} arquivo(s))')
+    else:
+        atual.caption('Verificando arquivos e recalculando as tabelas...')
+
+
+def acompanhar_atualizacao(tarefa):
+    # A atualização roda numa thread e as páginas seguem lendo a base anterior até a nova ser publicada;
+    # sair desta página interrompe só o acompanhamento, retomado ao voltar
+    with st.status('Atualizando Base de Dados...', expanded=not tarefa.done) as status:
+        if not tarefa.done:
+            cancelar = st.empty()
+            cancelar.button('Cancelar Atualização', on_click=tarefa.cancel, disabled=tarefa.cancelled.is_set())
+            barra = st.progress(0.0)
+            atual = st.empty()
+            while not tarefa.done:
+                mostrar_progresso(tarefa, barra, atual)
+                time.sleep(INTERVALO_PROGRESSO)
+            cancelar.empty()
+            atual.empty()
+            barra.progress(1.0)
+
+        resultado = tarefa.result
+        for erro in resultado.errors:
+            st.error(f'Erro ao Atualizar os Dados - {erro}', icon='❌')
+
+        st.caption(' | '.join(f'{fase}: {duracao:.2f}s' for fase, duracao in resultado.durations.items()))
+        for lote in resultado.batches:
+            st.caption(f"{lote['source']}: {lote['files']} arquivo(s), {lote['rows']} linhas em {lote['seconds']:.2f}s "
+                       f"({lote['rows_per_second'] or 0:.0f} linhas/s), pico de memória do DuckDB "
+                       f"{lote['duckdb_peak_memory'] / 2**20:.0f} MB"
+                       + (f", variação da memória do processo {lote['rss_change'] / 2**20:+.0f} MB"
+                          if lote['rss_change'] is not None else ''))
+
+        horario = time.strftime('%H:%M:%S', time.localtime(tarefa.finished))
+        if any(isinstance(erro, RefreshCancelled) for erro in resultado.errors):
+            status.update(label=f'Atualização cancelada às {horario}', state='error')
+        elif resultado.errors:
+            status.update(label=f'Erro ao Atualizar os Dados às {horario}', state='error')
+        else:
+            status.update(label=f'Base de Dados Atualizada às {horario}', state='complete')
+
+    if resultado.ok:
+        st.success(f'Dados Atualizados com Sucesso! {len(resultado.files_loaded)} arquivo(s) carregado(s), '
+                   f'{len(resultado.files_removed)} removido(s) - '
+                   f'{resultado.rows.get("extract", 0)} transações no extrato e '
+                   f'{resultado.rows.get("invoice", 0)} na fatura.', icon='✅')
@@ -0,0 +1,49 @@
+import threading
+from collections import OrderedDict
+
+import streamlit as st
+
+
+LIMITE_CACHE = 256 * 1024 * 1024
+
+
+class CacheConsultas:
+    def __init__(self, limite=LIMITE_CACHE):
+        self.limite = limite
+        self.tamanho = 0
+        self.entradas = OrderedDict()
+        self.geracoes = {}
+        self.trava = threading.Lock()
+
+    def invalidar(self, base, geracao):
+        if self.geracoes.get(base) == geracao:
+            return
+        for chave in [chave for chave in self.entradas if chave[0] == base]:
+            self.tamanho -= self.entradas.pop(chave)[1]
+        self.geracoes[base] = geracao
+
+    def obter(self, base, geracao, query, parametros, calcular):
+        chave = (base, query, repr(parametros))
+
+        with self.trava:
+            self.invalidar(base, geracao)
+            if chave in self.entradas:
+                self.entradas.move_to_end(chave)
+                return self.entradas[chave][0].copy()
+
+        df = calcular()
+        tamanho = int(df.memory_usage(index=True, deep=True).sum())
+
+        with self.trava:
+            if self.geracoes.get(base) == geracao and tamanho <= self.limite and chave not in self.entradas:
+                self.entradas[chave] = (df.copy(), tamanho)
+                self.tamanho += tamanho
+                while self.tamanho > self.limite:
+                    self.tamanho -= self.entradas.popitem(last=False)[1][1]
+
+        return df
+
+
+@st.cache_resource
+def cache_consultas():
+    return CacheConsultas()
@@ -0,0 +1,121 @@
+import os
+import threading
+import time
+import weakref
+
+import duckdb
+import streamlit as st
+
+from database.main import tenant_storage
+from pages.utils.diagnostico import Diagnostico
+
+
+TEMPO_OCIOSO = 300
+
+
+class Conexao:
+    def __init__(self, usuario=None, diagnostico=None):
+        self.database = tenant_storage(usuario).database
+        if not os.path.exists(self.database):
+            st.info('Nenhuma base de dados encontrada. Carregue os arquivos e clique em "Atualizar Base de Dados".')
+            st.stop()
+
+        self.diagnostico = diagnostico or Diagnostico()
+        self.entrada, self.con = gerenciador_conexoes().cursor(self.database, self)
+        self.geracao = geracao_base(self.con)
+
+    def execute(self, query, parametros=None):
+        return self.con.execute(query, parametros)
+
+    def close(self):
+        self.con.close()
+        gerenciador_conexoes().devolver(self.entrada, self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *erro):
+        self.close()
+
+
+class GerenciadorConexoes:
+    def __init__(self, ocioso=TEMPO_OCIOSO):
+        self.ocioso = ocioso
+        self.entradas = {}
+        self.trava = threading.Lock()
+
+    def cursor(self, database, dono):
+        identidade = identidade_arquivo(database)
+
+        with self.trava:
+            self.remover_ociosas()
+
+            # A atualização publica a base com um rename; a conexão aberta no arquivo anterior só é trocada quando
+            # ninguém a usa, e precisa ser fechada antes, senão o DuckDB devolve a mesma instância em cache
+            entrada = self.entradas.get(database)
+            if entrada and entrada['identidade'] != identidade and not entrada['donos']:
+                entrada['con'].close()
+                entrada = None
+
+            if entrada is None:
+                con = duckdb.connect(database=database, read_only=True)
+                # Os donos são guardados por referência fraca: uma página interrompida por st.stop() ou por uma
+                # exceção não chega a chamar close(), mas deixa de contar quando é coletada
+                entrada = self.entradas[database] = {'con': con, 'identidade': identidade, 'donos': weakref.WeakSet()}
+
+            entrada['donos'].add(dono)
+            entrada['uso'] = time.monotonic()
+            return entrada, entrada['con'].cursor()
+
+    def devolver(self, entrada, dono):
+        with self.trava:
+            entrada['donos'].discard(dono)
+            entrada['uso'] = time.monotonic()
+
+    def remover_ociosas(self):
+        agora = time.monotonic()
+        for database, entrada in list(self.entradas.items()):
+            if not entrada['donos'] and agora - entrada['uso'] > self.ocioso:
+                entrada['con'].close()
+                del self.entradas[database]
+
+
+@st.cache_resource
+def gerenciador_conexoes():
+    return GerenciadorConexoes()
+
+
+def identidade_arquivo(database):
+    try:
+        stat = os.stat(database)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def usuario_atual():
+    # Com MULTIUSUARIO definido, cada usuário (ou família) tem a própria base e pasta de arquivos em tenants/
+    if not os.environ.get('MULTIUSUARIO'):
+        return None
+
+    # Reatribuir o valor impede que o Streamlit descarte o estado do campo ao trocar de página
+    st.session_state['usuario'] = st.session_state.get('usuario', st.query_params.get('usuario', ''))
+    usuario = st.sidebar.text_input('Usuário', key='usuario').strip()
+    if not usuario:
+        st.info('Informe o usuário na barra lateral.')
+        st.stop()
+
+    try:
+        tenant_storage(usuario)
+    except ValueError:
+        st.error('Use apenas letras, números, "-" e "_" no nome do usuário.')
+        st.stop()
+    return usuario
+
+
+def geracao_base(con):
+    try:
+        return con.sql('select generation from metadata').fetchone()[0]
+    except duckdb.CatalogException:
+        # Base ainda não atualizada com a versão que registra a geração
+        return None
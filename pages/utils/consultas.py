@@ -0,0 +1,425 @@
+from pages.utils.cache import cache_consultas
+
+
+def consultar(con, nome, query, parametros=None):
+    executadas = []
+
+    def executar():
+        executadas.append(nome)
+        return con.diagnostico.executar(con.con, nome, query, parametros)
+
+    # Com a captura do EXPLAIN ANALYZE ligada a consulta sempre roda, para ter o perfil
+    if con.geracao is None or con.diagnostico.perfil:
+        return executar()
+
+    df = cache_consultas().obter(con.database, con.geracao, query, parametros, executar)
+    if not executadas:
+        con.diagnostico.registrar(nome, linhas=len(df), cache=True)
+    return df
+
+
+ORDENACOES = {'Data': 'data', 'Valor': 'valor'}
+
+
+def pagina(ordem, decrescente, cursor):
+    # Keyset em (ordem, id): a página seguinte começa depois da última linha da anterior, sem OFFSET
+    direcao, comparacao = ('desc', '<') if decrescente else ('asc', '>')
+    if cursor is None:
+        return '1=1', f'{ordem} {direcao}, id {direcao}', {}
+
+    filtro = f'({ordem} {comparacao} $cursor or ({ordem} = $cursor and id {comparacao} $cursor_id))'
+    return filtro, f'{ordem} {direcao}, id {direcao}', {'cursor': cursor[0], 'cursor_id': cursor[1]}
+
+
+######################################################################
+# Extrato
+
+def meses_extrato(con):
+    query = """
+        select
+            mes
+        from
+            extract_monthly
+        order by
+            mes
+    """
+
+    return consultar(con, 'meses_extrato', query)
+
+
+def contar_extrato_do_mes(con, mes):
+    query = """
+        select
+            count(*) as transacoes
+        from
+            extract
+        where
+            data >= $mes
+            and data < $mes + interval 1 month
+    """
+
+    return int(consultar(con, 'contar_extrato_do_mes', query, {'mes': mes})['transacoes'].iloc[0])
+
+
+def extrato_do_mes(con, mes, ordem='data', decrescente=False, limite=50, cursor=None):
+    filtro, ordenacao, parametros = pagina(ordem, decrescente, cursor)
+    query = f"""
+        select
+            id
+        ,   data
+        ,   tipo
+        ,   valor
+        ,   saldo as valor_acumulado
+        ,   descricao
+        ,   categoria
+        ,   case
+                when top <= 3 then '⭐⭐⭐'
+                when top <= 6 then '⭐⭐'
+                when top <= 10 then '⭐'
+                else ''
+            end as top
+        from
+            extract
+        where
+            data >= $mes
+            and data < $mes + interval 1 month
+            and {filtro}
+        order by
+            {ordenacao}
+        limit
+            $limite
+    """
+
+    return consultar(con, 'extrato_do_mes', query, {'mes': mes, 'limite': limite, **parametros})
+
+
+def gastos_diarios_extrato(con, mes):
+    query = """
+        select
+            data
+        ,   quantidade
+        ,   valor
+        from
+            extract_daily
+        where
+            mes = $mes
+        order by
+            data
+    """
+
+    return consultar(con, 'gastos_diarios_extrato', query, {'mes': mes})
+
+
+def saldos_mensais_extrato(con, meses):
+    query = """
+        select
+            mes
+        ,   aplicado
+        ,   resgatado
+        ,   investido
+        ,   ganhos
+        ,   gastos
+        ,   sobras
+        ,   entrada
+        ,   saida
+        ,   saldo_mes
+        from
+            extract_monthly
+        where
+            list_contains($meses::date[], mes)
+        order by
+            mes
+    """
+
+    return consultar(con, 'saldos_mensais_extrato', query, {'meses': meses})
+
+
+def distribuicao_gastos_extrato(con, meses):
+    query = """
+        select
+            mes
+        ,   q1
+        ,   mediana
+        ,   q3
+        ,   minimo
+        ,   maximo
+        ,   outliers
+        from
+            extract_distribution
+        where
+            list_contains($meses::date[], mes)
+        order by
+            mes
+    """
+
+    return consultar(con, 'distribuicao_gastos_extrato', query, {'meses': meses})
+
+
+def termos_busca(con, busca):
+    query = """
+        select distinct
+            unnest(tokenize($busca)) as termo
+        order by
+            1
+    """
+
+    return list(consultar(con, 'termos_busca', query, {'busca': busca})['termo'])
+
+
+def encontrados(tabela, termos):
+    # Cada palavra buscada é procurada como prefixo no índice de palavras, e a transação precisa ter todas. O prefixo
+    # vira um intervalo constante (de 'pix' até 'pix{', o caractere seguinte ao 'z'), e no índice gravado em ordem
+    # o DuckDB lê só os blocos desse intervalo, o que uma junção com a lista de palavras não permite
+    intervalos = ' union all '.join(
+        f"select id, {posicao} as termo from {tabela} where token >= $termo{posicao} and token < $termo{posicao} || '{{'"
+        for posicao in range(len(termos))
+    ) or f'select id, 0 as termo from {tabela} where false'
+
+    cte = f"""
+        encontrados as (
+            select
+                id
+            from
+                ({intervalos})
+            group by
+                id
+            having
+                count(distinct termo) = {len(termos)}
+        )"""
+
+    return cte, {f'termo{posicao}': termo for posicao, termo in enumerate(termos)}
+
+
+def buscar_extrato(con, busca, limite=100):
+    cte, parametros = encontrados('extract_tokens', termos_busca(con, busca))
+    query = f"""
+        with {cte}
+        select
+            data
+        ,   tipo
+        ,   valor
+        ,   descricao
+        ,   categoria
+        from
+            extract
+        where
+            id in (select id from encontrados)
+        order by
+            data desc, id desc
+        limit
+            $limite
+    """
+
+    return consultar(con, 'buscar_extrato', query, {**parametros, 'limite': limite})
+
+
+######################################################################
+# Fatura
+
+def meses_fatura(con):
+    query = """
+        select
+            mes
+        from
+            invoice_monthly
+        order by
+            mes
+    """
+
+    return consultar(con, 'meses_fatura', query)
+
+
+def contar_fatura_do_mes(con, mes):
+    query = """
+        select
+            count(*) as transacoes
+        from
+            invoice
+        where
+            data >= $mes
+            and data < $mes + interval 1 month
+    """
+
+    return int(consultar(con, 'contar_fatura_do_mes', query, {'mes': mes})['transacoes'].iloc[0])
+
+
+def fatura_do_mes(con, mes, ordem='data', decrescente=False, limite=50, cursor=None):
+    filtro, ordenacao, parametros = pagina(ordem, decrescente, cursor)
+    query = f"""
+        select
+            id
+        ,   data
+        ,   categoria
+        ,   valor
+        ,   titulo
+        ,   case
+                when top <= 3 then '⭐⭐⭐'
+                when top <= 6 then '⭐⭐'
+                when top <= 10 then '⭐'
+                else ''
+            end as top
+        from
+            invoice
+        where
+            data >= $mes
+            and data < $mes + interval 1 month
+            and {filtro}
+        order by
+            {ordenacao}
+        limit
+            $limite
+    """
+
+    return consultar(con, 'fatura_do_mes', query, {'mes': mes, 'limite': limite, **parametros})
+
+
+def gastos_diarios_fatura(con, mes):
+    query = """
+        select
+            data
+        ,   quantidade
+        ,   valor
+        from
+            invoice_daily
+        where
+            mes = $mes
+        order by
+            data
+    """
+
+    return consultar(con, 'gastos_diarios_fatura', query, {'mes': mes})
+
+
+def saldos_mensais_fatura(con, meses):
+    query = """
+        select
+            mes
+        ,   gastos
+        ,   pagamento_fatura
+        ,   saldo_mes
+        from
+            invoice_monthly
+        where
+            list_contains($meses::date[], mes)
+        order by
+            mes
+    """
+
+    return consultar(con, 'saldos_mensais_fatura', query, {'meses': meses})
+
+
+def distribuicao_gastos_fatura(con, meses):
+    query = """
+        select
+            mes
+        ,   q1
+        ,   mediana
+        ,   q3
+        ,   minimo
+        ,   maximo
+        ,   outliers
+        from
+            invoice_distribution
+        where
+            list_contains($meses::date[], mes)
+        order by
+            mes
+    """
+
+    return consultar(con, 'distribuicao_gastos_fatura', query, {'meses': meses})
+
+
+def buscar_fatura(con, busca, limite=100):
+    cte, parametros = encontrados('invoice_tokens', termos_busca(con, busca))
+    query = f"""
+        with {cte}
+        select
+            data
+        ,   categoria
+        ,   valor
+        ,   titulo
+        from
+            invoice
+        where
+            id in (select id from encontrados)
+        order by
+            data desc, id desc
+        limit
+            $limite
+    """
+
+    return consultar(con, 'buscar_fatura', query, {**parametros, 'limite': limite})
+
+
+######################################################################
+# Tendência
+
+def periodo(con):
+    query = """
+        select
+            least((select min(data) from extract_daily), (select min(data) from invoice_daily)) as inicio
+        ,   greatest((select max(data) from extract_daily), (select max(data) from invoice_daily)) as fim
+    """
+
+    return consultar(con, 'periodo', query).iloc[0]
+
+
+def tendencia(tabela, semanal):
+    # Divide o período em $pontos intervalos e mantém, em cada um, o dia (ou semana) de menor e o de maior gasto,
+    # o que preserva os picos da linha; com um período curto cada dia fica no seu próprio intervalo. A primeira
+    # semana só soma os dias a partir do início escolhido, e é marcada nesse dia
+    serie = f"""
+            select
+                greatest(date_trunc('week', data)::date, $inicio::date) as data
+            ,   sum(quantidade) as quantidade
+            ,   sum(valor) as valor
+            from
+                {tabela}
+            where
+                data >= $inicio
+                and data <= $fim
+            group by
+                1
+    """ if semanal else f"""
+            select
+                data
+            ,   quantidade
+            ,   valor
+            from
+                {tabela}
+            where
+                data >= $inicio
+                and data <= $fim
+    """
+
+    return f"""
+        with serie as ({serie}
+        ), intervalos as (
+            select
+                *
+            ,   (data - $inicio::date) * $pontos // ($fim::date - $inicio::date + 1) as intervalo
+            from
+                serie
+        )
+        select
+            data
+        ,   quantidade
+        ,   valor
+        from
+            intervalos
+        qualify
+            row_number() over (partition by intervalo order by valor, data) = 1
+            or row_number() over (partition by intervalo order by valor desc, data) = 1
+        order by
+            data
+    """
+
+
+def tendencia_extrato(con, inicio, fim, pontos, semanal=False):
+    query = tendencia('extract_daily', semanal)
+    return consultar(con, 'tendencia_extrato', query, {'inicio': inicio, 'fim': fim, 'pontos': pontos})
+
+
+def tendencia_fatura(con, inicio, fim, pontos, semanal=False):
+    query = tendencia('invoice_daily', semanal)
+    return consultar(con, 'tendencia_fatura', query, {'inicio': inicio, 'fim': fim, 'pontos': pontos})
@@ -0,0 +1,108 @@
+import json
+import os
+import tempfile
+import time
+
+import pandas as pd
+import streamlit as st
+
+
+class Diagnostico:
+    def __init__(self, pagina=None, perfil=False, log=None, pai=None):
+        self.pagina = pagina
+        self.perfil = perfil
+        self.log = log or os.environ.get('DIAGNOSTICO_LOG')
+        self.pai = pai
+        self.concluido = False
+        self.inicio = time.perf_counter()
+        self.registros = []
+
+    def executar(self, con, nome, query, parametros=None):
+        # O EXPLAIN ANALYZE não aceita parâmetros, então o perfil vem do profiling da própria execução
+        if self.perfil:
+            fd, saida = tempfile.mkstemp(prefix='perfil-', suffix='.txt')
+            os.close(fd)
+            con.execute("pragma enable_profiling = 'query_tree';")
+            con.execute(f"pragma profiling_output = '{saida}';")
+
+        inicio = time.perf_counter()
+        resultado = con.execute(query, parametros)
+        execucao = time.perf_counter() - inicio
+
+        # Mantém os dados em Arrow: as colunas do pandas apenas apontam para os buffers do resultado,
+        # sem criar um objeto Python por linha (as datas já chegam como date32)
+        df = resultado.arrow().to_pandas(types_mapper=pd.ArrowDtype)
+        conversao = time.perf_counter() - inicio - execucao
+
+        perfil = None
+        if self.perfil:
+            con.execute('pragma disable_profiling;')
+            with open(saida) as f:
+                perfil = f.read()
+            os.remove(saida)
+
+        self.registrar(nome, execucao=execucao, conversao=conversao, linhas=len(df), cache=False, perfil=perfil)
+        return df
+
+    def registrar(self, nome, execucao=0.0, conversao=0.0, linhas=None, cache=False, perfil=None):
+        registro = {'nome': nome, 'execucao': execucao, 'conversao': conversao,
+                    'linhas': linhas, 'cache': cache, 'perfil': perfil}
+        self.registros.append(registro)
+
+        # Na execução completa os blocos também registram no diagnóstico da página, que já está concluído
+        # quando um bloco é reexecutado sozinho
+        if self.pai and not self.pai.concluido:
+            self.pai.registros.append(registro)
+
+        if self.log:
+            with open(self.log, 'a') as f:
+                f.write(json.dumps({'momento': time.time(), 'pagina': self.pagina, **registro}, ensure_ascii=False) + '\n')
+
+
+def iniciar_diagnostico(pagina, pai=None):
+    return Diagnostico(pagina, perfil=st.session_state.get('diagnostico_perfil', False), pai=pai)
+
+
+def mostrar_registros(diagnostico):
+    st.metric('Tempo total da execução', f'{(time.perf_counter() - diagnostico.inicio) * 1000:.0f} ms')
+
+    if diagnostico.registros:
+        df = pd.DataFrame(diagnostico.registros)
+        df['execucao'] = df['execucao'] * 1000
+        df['conversao'] = df['conversao'] * 1000
+        st.dataframe(df[['nome', 'execucao', 'conversao', 'linhas', 'cache']], hide_index=True,
+                     column_config={
+                         'nome': 'Consulta',
+                         'execucao': st.column_config.NumberColumn('SQL (ms)', format='%.1f'),
+                         'conversao': st.column_config.NumberColumn('Conversão (ms)', format='%.1f'),
+                         'linhas': 'Linhas',
+                         'cache': 'Cache'
+                     })
+
+    for registro in diagnostico.registros:
+        if registro['perfil']:
+            st.caption(registro['nome'])
+            st.code(registro['perfil'], language=None)
+
+
+def mostrar_diagnostico(diagnostico, bloco=None):
+    # O painel da página é o último passo da execução completa; depois dele os blocos param de registrar nele
+    if not bloco:
+        diagnostico.concluido = True
+
+    # Painel escondido, aberto com ?diagnostico=1 na URL da página
+    if st.query_params.get('diagnostico') != '1':
+        return
+
+    # Um fragmento tem o próprio diagnóstico, mostrado dentro dele e refeito quando só ele é reexecutado;
+    # a barra lateral não pode ser alterada por um fragmento, e o painel dela lista as consultas de todos os
+    # blocos na última execução completa da página
+    if bloco:
+        with st.expander(f'Diagnóstico: {bloco}'):
+            mostrar_registros(diagnostico)
+        return
+
+    with st.sidebar.expander('Diagnóstico', expanded=True):
+        st.caption('Todas as consultas da última execução completa da página; blocos reexecutados sozinhos mostram o próprio painel')
+        mostrar_registros(diagnostico)
+        st.checkbox('Capturar EXPLAIN ANALYZE', key='diagnostico_perfil')
@@ -0,0 +1,38 @@
+import math
+
+import streamlit as st
+
+from pages.utils.consultas import ORDENACOES
+
+
+TAMANHOS_PAGINA = [25, 50, 100, 250]
+
+
+def controles_paginacao(chave):
+    col1, col2, col3 = st.columns(3)
+    ordenacao = col1.selectbox('Ordenar por', list(ORDENACOES), key=f'{chave}_ordenacao')
+    direcao = col2.selectbox('Ordem', ['Crescente', 'Decrescente'], key=f'{chave}_direcao')
+    tamanho = col3.selectbox('Linhas por página', TAMANHOS_PAGINA, index=1, key=f'{chave}_tamanho')
+    return ORDENACOES[ordenacao], direcao == 'Decrescente', tamanho
+
+
+def cursor_pagina(chave, contexto):
+    # Guarda a chave (ordem, id) da última linha de cada página já vista; mudar usuário, mês, ordem ou tamanho volta
+    # à primeira
+    estado = st.session_state.get(f'{chave}_paginas')
+    if estado is None or estado['contexto'] != contexto:
+        estado = st.session_state[f'{chave}_paginas'] = {'contexto': contexto, 'cursores': [None]}
+    return estado['cursores'][-1]
+
+
+def navegacao(chave, df, ordem, total, tamanho):
+    cursores = st.session_state[f'{chave}_paginas']['cursores']
+    atual = len(cursores)
+    paginas = max(1, math.ceil(total / tamanho))
+    proximo = (df[ordem].iloc[-1], df['id'].iloc[-1]) if len(df) else None
+
+    col1, col2, col3 = st.columns([1, 1, 6])
+    col1.button('Anterior', key=f'{chave}_anterior', disabled=atual == 1, on_click=cursores.pop)
+    col2.button('Próxima', key=f'{chave}_proxima', disabled=atual >= paginas,
+                on_click=cursores.append, args=(proximo,))
+    col3.caption(f'Página {atual} de {paginas} · {total} transações')
@@ -1,20 +1,65 @@
-import locale
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
 
 
-def formatar_dinheiro(valor):
-    locale.setlocale(locale.LC_ALL, 'pt_BR.UTF-8')
-    return 'R$ ' + locale.currency(valor, grouping=True, symbol=None)
+VERDE = 'background-color: rgba(144, 238, 144, 0.3)'
+VERMELHO = 'background-color: rgba(255, 160, 122, 0.3)'
 
+APLICACOES = ['Aplicação RDB', 'Compra de CDB']
+RESGATES = ['Resgate RDB']
 
-def colorir_celula_valor(valor):
-    if valor > 0:
-        return 'background-color: rgba(144, 238, 144, 0.3)'
-    else:
-        return 'background-color: rgba(255, 160, 122, 0.3)'
 
+def para_grafico(df):
+    # O Plotly não aceita date32 do Arrow; datetime64 converte a coluna inteira sem objetos Python por linha
+    datas = {coluna: df[coluna].astype('datetime64[s]') for coluna in df.columns
+             if isinstance(df[coluna].dtype, pd.ArrowDtype) and df[coluna].dtype.kind == 'M'}
+    return df.assign(**datas)
 
-def colorir_celula_investimento(tipo):
-    if tipo in ['Aplicação RDB', 'Compra de CDB']:
-        return 'background-color: rgba(144, 238, 144, 0.3)'
-    if tipo in ['Resgate RDB']:
-        return 'background-color: rgba(255, 160, 122, 0.3)'
+
+def boxplot(df, cor):
+    # As estatísticas já vêm calculadas por mês; só os outliers guardados são desenhados como pontos
+    df = para_grafico(df)
+    outliers = df[['mes', 'outliers']].explode('outliers').dropna()
+
+    fig = go.Figure()
+    fig.add_trace(go.Box(x=df['mes'], q1=df['q1'], median=df['mediana'], q3=df['q3'],
+                         lowerfence=df['minimo'], upperfence=df['maximo'], name='Valor', marker_color=cor))
+    fig.add_trace(go.Scatter(x=outliers['mes'], y=outliers['outliers'], mode='markers', name='Outliers',
+                             marker_color=cor))
+    fig.update_layout(showlegend=False)
+    return fig
+
+
+def formatar_dinheiro(valores):
+    # Formatação pt-BR feita na coluna inteira, sem depender do locale instalado no sistema
+    valores = pd.Series(valores).to_numpy(dtype=float, na_value=np.nan)
+    texto = pd.Series(np.char.mod('%.2f', np.abs(valores)), dtype=object)
+    texto = texto.str.replace('.', ',', regex=False).str.replace(r'(\d)(?=(\d{3})+,)', r'\1.', regex=True)
+    sinal = pd.Series(np.where(valores < 0, 'R$ -', 'R$ '))
+    return sinal + texto
+
+
+def colorir_valor(df):
+    valores = df.to_numpy(dtype=float, na_value=np.nan)
+    return pd.DataFrame(np.where(valores > 0, VERDE, VERMELHO), index=df.index, columns=df.columns)
+
+
+def colorir_investimento(df):
+    aplicacoes = df.isin(APLICACOES).to_numpy(dtype=bool)
+    resgates = df.isin(RESGATES).to_numpy(dtype=bool)
+    cores = np.select([aplicacoes, resgates], [VERDE, VERMELHO], '')
+    return pd.DataFrame(cores, index=df.index, columns=df.columns)
+
+
+def estilizar(df, colunas_dinheiro, colunas_investimento=None):
+    estilo = df.style.apply(colorir_valor, axis=None, subset=colunas_dinheiro)
+
+    if colunas_investimento:
+        estilo = estilo.apply(colorir_investimento, axis=None, subset=colunas_investimento)
+
+    for coluna in colunas_dinheiro:
+        textos = dict(zip(df[coluna], formatar_dinheiro(df[coluna])))
+        estilo = estilo.format(lambda valor, textos=textos: textos.get(valor, ''), subset=[coluna])
+
+    return estilo